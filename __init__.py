@@ -1,4 +1,13 @@
-from mcconnect import connect
-from mcconnect import errors
-from mcconnect import query
-from mcconnect import rcon
\ No newline at end of file
+"""Submodules are imported when they are first used (e.g. mcconnect.connect), so using only query or rcon never loads asyncssh."""
+
+import importlib
+
+__all__ = ["cache","connect","errors","fleet","metrics","monitor","query","rcon","slp","subscription"]
+
+def __getattr__(name : str):
+    if name in __all__:
+        return importlib.import_module(f"mcconnect.{name}") # Also sets it as an attribute of the package
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
\ No newline at end of file
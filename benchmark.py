@@ -0,0 +1,263 @@
+"""Repeatable benchmarks for the query and rcon modules, run against the local servers from fakeservers, and for the import time of the package.\n
+Usage: python -m mcconnect.benchmark [name ...] (runs every benchmark if no name is given)
+"""
+
+import asyncio, contextlib, itertools, sys, time, tracemalloc
+from typing import Awaitable, Callable
+from mcconnect.fakeservers import FakeQueryServer, FakeRconServer
+from mcconnect.query import QueryClient, QueryConnection
+from mcconnect.rcon import Rconnection, ResponseDecoder, removeColours
+
+BENCHMARKS : dict[str, Callable[[], Awaitable[dict]]] = {}
+
+def benchmark(function : Callable[[], Awaitable[dict]]) -> Callable[[], Awaitable[dict]]:
+    """Registers a benchmark. It has to return a dictionary of the figures to report."""
+    BENCHMARKS[function.__name__] = function
+    return function
+
+def percentile(values : list[float], fraction : float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered)-1,int(len(ordered)*fraction))]
+
+async def measure(operation : Callable[[], Awaitable], count : int, concurrency : int) -> dict:
+    """Runs operation count times with at most concurrency runs at once and reports the rate and latency percentiles"""
+    latencies : list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    async def run():
+        async with semaphore:
+            started = time.perf_counter()
+            await operation()
+            latencies.append(time.perf_counter() - started)
+        pass
+    started = time.perf_counter()
+    await asyncio.gather(*(run() for _ in range(count)))
+    elapsed = time.perf_counter() - started
+    return {"per second":count/elapsed, "p50 ms":percentile(latencies,0.5)*1000, "p99 ms":percentile(latencies,0.99)*1000}
+
+async def measureServers(servers : int, players : list[str], isFullStat : bool, count : int, concurrency : int) -> dict:
+    """Measures stat requests to servers fake servers in turn over a shared QueryClient.\n
+    Concurrent requests to one server share a single answer, so the requests are spread over many servers to measure real round trips.
+    """
+    async with contextlib.AsyncExitStack() as stack:
+        client = await stack.enter_async_context(QueryClient())
+        connections = []
+        for _ in range(servers):
+            server = await stack.enter_async_context(FakeQueryServer(players=players))
+            connections.append(QueryConnection(*server.address,client=client))
+            pass
+        turn = itertools.cycle(connections)
+        stat = QueryConnection.fullStat if isFullStat else QueryConnection.basicStat
+        return await measure(lambda: stat(next(turn)),count,concurrency)
+    pass
+
+@benchmark
+async def queryBasicStat(count : int = 5000, concurrency : int = 256, servers : int = 256) -> dict:
+    """basicStat over a shared QueryClient (with cached challenge tokens)"""
+    return await measureServers(servers,["Steve","Alex"],False,count,concurrency)
+
+@benchmark
+async def queryFullStat(count : int = 5000, concurrency : int = 256, servers : int = 256) -> dict:
+    """fullStat of servers with 100 players over a shared QueryClient"""
+    return await measureServers(servers,[f"Player{i}" for i in range(100)],True,count,concurrency)
+
+@benchmark
+async def queryWithoutClient(count : int = 1000, concurrency : int = 64) -> dict:
+    """basicStat with a socket and handshake per request (no shared QueryClient)"""
+    async with FakeQueryServer() as server:
+        connection = QueryConnection(*server.address)
+        return await measure(connection.basicStat,count,concurrency)
+    pass
+
+@benchmark
+async def rconCommand(count : int = 5000, concurrency : int = 64) -> dict:
+    """Concurrent short commands on one Rconnection (one packet per round trip, as vanilla servers need)"""
+    async with FakeRconServer() as server:
+        rcon = Rconnection(*server.address,server.password)
+        await rcon.start()
+        try:
+            return await measure(lambda: rcon.command("list"),count,concurrency)
+        finally:
+            await rcon.close()
+    pass
+
+@benchmark
+async def rconCommandPipelined(count : int = 5000, concurrency : int = 64) -> dict:
+    """Concurrent short commands on one pipelined Rconnection (against a server that splits packets by their length)"""
+    async with FakeRconServer(vanillaFraming=False) as server:
+        rcon = Rconnection(*server.address,server.password,pipeline=True)
+        await rcon.start()
+        try:
+            return await measure(lambda: rcon.command("list"),count,concurrency)
+        finally:
+            await rcon.close()
+    pass
+
+@benchmark
+async def rconBatch(count : int = 5000) -> dict:
+    """Short commands sent with Rconnection.commands"""
+    async with FakeRconServer() as server:
+        rcon = Rconnection(*server.address,server.password)
+        await rcon.start()
+        try:
+            started = time.perf_counter()
+            await rcon.commands(["list"]*count)
+            return {"per second":count/(time.perf_counter() - started)}
+        finally:
+            await rcon.close()
+    pass
+
+@benchmark
+async def rconBatchPipelined(count : int = 5000) -> dict:
+    """Short commands sent with Rconnection.commands on a pipelined Rconnection (against a server that splits packets by their length)"""
+    async with FakeRconServer(vanillaFraming=False) as server:
+        rcon = Rconnection(*server.address,server.password,pipeline=True)
+        await rcon.start()
+        try:
+            started = time.perf_counter()
+            await rcon.commands(["list"]*count)
+            return {"per second":count/(time.perf_counter() - started)}
+        finally:
+            await rcon.close()
+    pass
+
+@benchmark
+async def rconLargeResponse(count : int = 200, size : int = 1 << 20) -> dict:
+    """Commands with responses of size bytes (split into many packets)"""
+    async with FakeRconServer() as server:
+        rcon = Rconnection(*server.address,server.password)
+        await rcon.start()
+        try:
+            result = await measure(lambda: rcon.command(f"big {size}"),count,1)
+            result["MB/s"] = result["per second"] * size / 1e6
+            return result
+        finally:
+            await rcon.close()
+    pass
+
+COLOURED_LINE = "§6[Plugin] §aSteve§r joined §lthe game§r, welcome Zoë! ✓\n"
+
+def _removeColoursQuadratic(payload : bytes) -> bytes:
+    """removeColours as it used to be, for comparison"""
+    discoloured = b""
+    for part in payload.split(b"\xa7"):
+        discoloured += part[1:]
+        pass
+    return discoloured
+
+def _throughput(function : Callable[[bytes], object], payload : bytes) -> float:
+    """Runs function on payload once and returns the throughput in MB/s"""
+    started = time.perf_counter()
+    function(payload)
+    return len(payload) / (time.perf_counter() - started) / 1e6
+
+@benchmark
+async def colourStripping(size : int = 1 << 20) -> dict:
+    """removeColours and ResponseDecoder against the old removeColours on coloured output of size bytes"""
+    payload = (COLOURED_LINE * (size // len(COLOURED_LINE.encode("utf-8")) + 1)).encode("utf-8")[:size]
+    def decodeInChunks(payload : bytes):
+        decoder = ResponseDecoder()
+        for start in range(0,len(payload),4096):
+            decoder.decode(payload[start:start+4096])
+            pass
+        decoder.decode(b"",final=True)
+        pass
+    return {
+        "old MB/s":_throughput(_removeColoursQuadratic,payload),
+        "new MB/s":_throughput(removeColours,payload),
+        "decoder MB/s":_throughput(decodeInChunks,payload)
+    }
+
+@benchmark
+async def rconColouredStream(count : int = 20, size : int = 1 << 20) -> dict:
+    """Rconnection.streamText on coloured responses of size bytes"""
+    line = COLOURED_LINE.encode("utf-8")
+    async with FakeRconServer(handler=lambda command: COLOURED_LINE * (size // len(line))) as server:
+        rcon = Rconnection(*server.address,server.password)
+        await rcon.start()
+        try:
+            async def run():
+                async for _ in rcon.streamText("dump"):
+                    pass
+                pass
+            result = await measure(run,count,1)
+            result["MB/s"] = result["per second"] * size / 1e6
+            return result
+        finally:
+            await rcon.close()
+    pass
+
+async def _startServerProcess() -> tuple[asyncio.subprocess.Process,dict[str,tuple[str,int]]]:
+    """Runs the fake servers in their own process, so their memory isn't counted"""
+    process = await asyncio.create_subprocess_exec(sys.executable,"-m","mcconnect.fakeservers",stdout=asyncio.subprocess.PIPE)
+    addresses = {}
+    for _ in range(2):
+        name, ip, port = (await process.stdout.readline()).decode().split()
+        addresses[name] = (ip,int(port))
+        pass
+    return process, addresses
+
+@benchmark
+async def memory(count : int = 1000) -> dict:
+    """Memory allocated per thousand QueryConnections (each with a finished fullStat) and per thousand started Rconnections"""
+    process, addresses = await _startServerProcess()
+    try:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        client = QueryClient()
+        queryConnections = [QueryConnection(*addresses["query"],client=client) for _ in range(count)]
+        queryResults = await asyncio.gather(*(connection.fullStat() for connection in queryConnections))
+        queryMemory = tracemalloc.get_traced_memory()[0] - before
+
+        before = tracemalloc.get_traced_memory()[0]
+        rconConnections = [Rconnection(*addresses["rcon"],"test") for _ in range(count)]
+        await asyncio.gather(*(rcon.start() for rcon in rconConnections))
+        rconMemory = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        client.close()
+        await asyncio.gather(*(rcon.close() for rcon in rconConnections))
+        return {"query KiB/1000":queryMemory/1024*1000/count, "rcon KiB/1000":rconMemory/1024*1000/count}
+    finally:
+        process.terminate()
+        await process.wait()
+    pass
+
+IMPORT_PROBE = "import sys, time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started, 'asyncssh' in sys.modules)"
+
+async def _importTime(module : str) -> tuple[float,bool]:
+    """Imports module in a fresh interpreter and returns how long it took and whether asyncssh got loaded"""
+    process = await asyncio.create_subprocess_exec(sys.executable,"-c",IMPORT_PROBE.format(module=module),stdout=asyncio.subprocess.PIPE)
+    output, _ = await process.communicate()
+    seconds, asyncssh = output.decode().split()
+    return float(seconds), asyncssh == "True"
+
+@benchmark
+async def importTime(count : int = 10) -> dict:
+    """Time to import the package and its modules in a fresh interpreter (median of count runs); only connect may load asyncssh"""
+    result = {}
+    for module in ("mcconnect","mcconnect.query","mcconnect.rcon","mcconnect.slp","mcconnect.connect"):
+        times = []
+        for _ in range(count):
+            seconds, asyncssh = await _importTime(module)
+            if asyncssh and module != "mcconnect.connect":
+                raise RuntimeError(f"Importing {module} loaded asyncssh")
+            times.append(seconds)
+            pass
+        result[f"{module.partition('.')[2] or 'package'} ms"] = percentile(times,0.5)*1000
+        pass
+    return result
+
+async def main(names : list[str]):
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if len(unknown) > 0:
+        print("Unknown benchmarks:",", ".join(unknown),"\nAvailable:",", ".join(BENCHMARKS))
+        return
+    for name in names or BENCHMARKS:
+        figures = await BENCHMARKS[name]()
+        print(f"{name:<22}" + "  ".join(f"{figure}: {value:.1f}" for figure, value in figures.items()),flush=True)
+        pass
+    pass
+
+if __name__=="__main__":
+    asyncio.run(main(sys.argv[1:]))
+    pass
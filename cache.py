@@ -0,0 +1,87 @@
+"""A small asyncio result cache with request coalescing and stale-while-revalidate.\n
+Used by query.QueryConnection to answer repeated stat requests without asking the server every time.
+"""
+
+import asyncio, logging
+from typing import Awaitable, Callable, Hashable
+
+class TTLCache:
+    """Caches the results of coroutines by key for ttl seconds.\n
+    Concurrent requests for a key that isn't cached share a single call of the fetch function.\n
+    If staleTTL is given, an expired value is still handed out for up to staleTTL more seconds while a refresh runs in the background.\n
+    The counters hits, staleHits, misses and coalesced (misses that joined an already running fetch) tell how well the cache works; see TTLCache.stats.\n
+    Note: Cached values are shared between every caller, so they shouldn't be modified.
+    """
+    def __init__(self, ttl : float = 5, *, staleTTL : float = 0):
+        self.ttl = ttl
+        self.staleTTL = staleTTL
+
+        self._entries : dict[Hashable, tuple[object,float]] = {} # Value and the time it was fetched
+        self._fetches : dict[Hashable, asyncio.Task] = {}
+
+        self.hits = 0
+        self.staleHits = 0
+        self.misses = 0
+        self.coalesced = 0
+        pass
+
+    @property
+    def stats(self) -> dict[str,int]:
+        return {"hits":self.hits,"staleHits":self.staleHits,"misses":self.misses,"coalesced":self.coalesced,"entries":len(self._entries)}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def invalidate(self, key : Hashable = None) -> None:
+        """Forgets the value for key, or every value if no key is given. Running fetches are not affected.
+        """
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key,None)
+        pass
+
+    def _refresh(self, key : Hashable, fetch : Callable[[], Awaitable]) -> asyncio.Task:
+        task = self._fetches.get(key)
+        if task is not None:
+            return task
+
+        async def run():
+            value = await fetch()
+            self._entries[key] = (value, asyncio.get_running_loop().time())
+            return value
+
+        task = asyncio.ensure_future(run())
+        self._fetches[key] = task
+        def forget(task : asyncio.Task):
+            if self._fetches.get(key) is task:
+                del self._fetches[key]
+            if not task.cancelled() and task.exception() is not None:
+                logging.debug(f"Fetching {key} for the cache failed: {task.exception()!r}")
+            pass
+        task.add_done_callback(forget)
+        return task
+
+    async def get(self, key : Hashable, fetch : Callable[[], Awaitable]):
+        """Returns the cached value for key or awaits fetch() to get a new one.\n
+        Errors raised by fetch are passed on to every waiting caller and are not cached.\n
+        This function is a coroutine
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetchedAt = entry
+            age = asyncio.get_running_loop().time() - fetchedAt
+            if age < self.ttl:
+                self.hits += 1
+                return value
+            if age < self.ttl + self.staleTTL:
+                self.staleHits += 1
+                self._refresh(key,fetch) # Revalidate in the background
+                return value
+            pass
+
+        self.misses += 1
+        if key in self._fetches:
+            self.coalesced += 1
+        return await asyncio.shield(self._refresh(key,fetch)) # A caller giving up must not cancel the fetch for the others
+    pass
@@ -1,16 +1,173 @@
-import asyncssh, asyncio, subprocess, logging
+import asyncssh, asyncio, subprocess, logging, re, collections
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Union
 
 from asyncssh.process import SSHClientProcess
 from mcconnect.errors import *
+from mcconnect import metrics
+from mcconnect.fleet import FleetResult, runBounded
+from mcconnect.query import QueryClient
+from mcconnect.subscription import Subscription
+
+READY_PATTERN   = r"Done \("
+STOPPED_PATTERN = r"All dimensions are saved"
+
+PROBE_PORTS = {"tcp":None, "query":25565, "rcon":25575} # None: the SSH port
+
+async def probeTcp(ip : str, port : int, *, timeout : float = 2) -> bool:
+    """Checks if a TCP connection to ip:port can be opened within timeout seconds.\n
+    This function is a coroutine
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip,port),timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+async def probeQuery(ip : str, port : int = 25565, *, timeout : float = 2, client : QueryClient = None) -> bool:
+    """Checks if the Minecraft server at ip:port answers a query handshake within timeout seconds.\n
+    Uses client if given, otherwise a temporary QueryClient.\n
+    This function is a coroutine
+    """
+    try:
+        if client is not None:
+            await client.ping((ip,port),timeout=timeout)
+        else:
+            async with QueryClient() as client:
+                await client.ping((ip,port),timeout=timeout)
+        return True
+    except (ConnectionError, OSError):
+        return False
+    pass
+
+async def probeRcon(ip : str, port : int = 25575, *, timeout : float = 2) -> bool:
+    """Checks if the RCON port of the Minecraft server at ip:port accepts connections within timeout seconds.\n
+    This function is a coroutine
+    """
+    return await probeTcp(ip,port,timeout=timeout)
+
+async def probeHosts(connections : Iterable["Connection"], *, concurrency : int = 64, useCache : bool = True) -> AsyncIterator[FleetResult]:
+    """Checks which hosts are awake, probing at most concurrency of them at once.\n
+    Yields a fleet.FleetResult (target being the Connection, result the result of Connection.isAwake) per host as soon as it is known.
+    """
+    async def probe(connection : Connection) -> bool:
+        return await connection.isAwake(useCache=useCache)
+    async for result in runBounded(probe,connections,concurrency=concurrency):
+        yield result
+        pass
+    pass
+
+class LogSubscription(Subscription[str]):
+    """A subscription.Subscription to the lines a ServerLog receives, created by ServerLog.subscribe.\n
+    A consumer falling behind by more than maxsize lines loses the oldest ones instead of slowing down the server output. The iteration ends when the server output ends or the subscription is closed.
+    """
+    def __init__(self, log : "ServerLog", maxsize : int):
+        super().__init__(log._subscriptions,maxsize)
+        self.log = log
+        pass
+    pass
+
+class ServerLog:
+    """Collects the output of a server line by line.\n
+    The last history lines are kept in self.lines. Every line is handed to all subscriptions (see ServerLog.subscribe) and checked against every pattern someone waits for (see ServerLog.waitFor).
+    Pushing a line never waits for consumers.
+    """
+    def __init__(self, history : int = 1000):
+        self.lines : collections.deque[str] = collections.deque(maxlen=history)
+        self.closed = False
+        self._subscriptions : set[LogSubscription] = set()
+        self._watchers : list[tuple[re.Pattern,asyncio.Future]] = []
+        pass
+
+    def push(self, line : str) -> None:
+        """Adds a line of output"""
+        self.lines.append(line)
+        for subscription in self._subscriptions:
+            subscription._put(line)
+            pass
+        if len(self._watchers) > 0:
+            remaining = []
+            for pattern, future in self._watchers:
+                if future.done(): # The waiter gave up
+                    continue
+                match = pattern.search(line)
+                if match is not None:
+                    future.set_result(match)
+                else:
+                    remaining.append((pattern, future))
+                pass
+            self._watchers = remaining
+        pass
+
+    def close(self) -> None:
+        """Marks the end of the output. Subscriptions end and waiting watchers fail with a ConnectionError."""
+        self.closed = True
+        for subscription in list(self._subscriptions):
+            subscription.close()
+            pass
+        for pattern, future in self._watchers:
+            if not future.done():
+                future.set_exception(ConnectionError(f"Server output ended before {pattern.pattern!r} was found"))
+            pass
+        self._watchers = []
+        pass
+
+    def subscribe(self, maxsize : int = 1000) -> LogSubscription:
+        """Returns a subscription that receives every line from now on.\n
+        Usage: async for line in log.subscribe(): ...
+        """
+        subscription = LogSubscription(self,maxsize)
+        if self.closed:
+            subscription.queue.put_nowait(None)
+        else:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    async def waitFor(self, pattern : Union[str,re.Pattern], *, timeout : float = None, searchHistory : bool = False) -> re.Match:
+        """Waits for a line matching pattern (a regex, compiled or not) and returns the match.\n
+        If searchHistory is True, lines that were already received are searched first.\n
+        Raises a ConnectionError if the output ends first and an asyncio.TimeoutError after timeout seconds.\n
+        This function is a coroutine
+        """
+        if isinstance(pattern,str):
+            pattern = re.compile(pattern)
+        if searchHistory:
+            for line in self.lines:
+                match = pattern.search(line)
+                if match is not None:
+                    return match
+                pass
+        if self.closed:
+            raise ConnectionError(f"Server output ended before {pattern.pattern!r} was found")
+        future = asyncio.get_running_loop().create_future()
+        self._watchers.append((pattern, future))
+        try:
+            return await asyncio.wait_for(future,timeout)
+        finally:
+            future.cancel() # Cleaned up on the next line
+        pass
+    pass
 
 class Connection:
     """This class can be used to establish a connection to a host machine and launch a Minecraft Server (or any server actually) on it.\n
     The class provides many utilities such as checking if the host is awake, waking it up, starting the server, sending a command to it and watching for output if neccessary.\n
     \n
     The wakeCommand argument needs to contain a command that by some means causes the host to boot up and then waits until that process is completed. If it completed successfully, it should output exit state 0, if not some other value.\n
-    If provided, the pingCommand needs to be a command that checks if the host is awake and returns exit code 0 if it is.
+    If wake is used with waitUntilReady=True, the wakeCommand only needs to trigger the boot; the host is then polled until it is awake.\n
+    \n
+    How the host is checked for being awake depends on probe:
+      + "tcp" (default): Open a TCP connection to the SSH port (or probePort)
+      + "query": Do a query handshake with the Minecraft server at probePort (25565 by default)
+      + "rcon": Open a TCP connection to the RCON port (probePort, 25575 by default)
+      + "ping": Run the pingCommand ("ping {ip} -c 1" by default), which needs to check if the host is awake and return exit code 0 if it is.
+    If a pingCommand is given, probe defaults to "ping"; giving a pingCommand together with another probe raises a ValueError.
+    Every probe gives up after probeTimeout seconds. Its result is cached for probeCacheTTL seconds.
     """
-    def __init__(self,hostIP : str,username : str, password : str,launchCommand : str,wakeCommand : str,shutdownCommand : str,stopCommand : str,*,port : int = 22,disableHostKeyChecking=False,pingCommand : str = "ping {ip} -c 1"):
+    def __init__(self,hostIP : str,username : str, password : str,launchCommand : str,wakeCommand : str,shutdownCommand : str,stopCommand : str,*,port : int = 22,disableHostKeyChecking=False,pingCommand : str = None,probe : str = None,probePort : int = None,probeTimeout : float = 2,probeCacheTTL : float = 2):
+        if probe is None:
+            probe = "tcp" if pingCommand is None else "ping"
+        if probe != "ping" and probe not in PROBE_PORTS: raise ValueError(f"Unknown probe {probe!r}")
+        if probe != "ping" and pingCommand is not None: raise ValueError(f"pingCommand is only used by the ping probe, not by {probe!r}")
         self.sshAddress = (hostIP,port)
         self.wakeCommand = wakeCommand
         self.shutdownCommand = shutdownCommand
@@ -24,16 +181,57 @@ class Connection:
         self.sshConn : asyncssh.SSHClientConnection = None
         self.serverProcess : asyncssh.SSHClientProcess = None
 
-        self.PING_CMD = pingCommand
+        self.PING_CMD = pingCommand if pingCommand is not None else "ping {ip} -c 1"
+        self.probe = probe
+        self.probePort = probePort
+        self.probeTimeout = probeTimeout
+        self.probeCacheTTL = probeCacheTTL
+        self._awake : tuple[bool,float] = None # Last probe result and when it expires
+        self.log = ServerLog()
+        pass
+
+    async def _probe(self) -> bool:
+        ip = self.sshAddress[0]
+        if self.probe == "ping":
+            process : asyncio.subprocess.Process = await asyncio.create_subprocess_shell(self.PING_CMD.format(ip=ip),stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+            try:
+                return await asyncio.wait_for(process.wait(),self.probeTimeout) == 0
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait() # Reap it; no zombie per timed out probe
+                return False
+        port = self.probePort if self.probePort is not None else (PROBE_PORTS[self.probe] or self.sshAddress[1])
+        if self.probe == "query":
+            return await probeQuery(ip,port,timeout=self.probeTimeout)
+        return await probeTcp(ip,port,timeout=self.probeTimeout) # tcp and rcon
         pass
 
-    async def isAwake(self) -> bool:
+    async def isAwake(self, *, useCache : bool = True) -> bool:
         """Checks if the host is currently awake (read: running)\n
+        A result younger than self.probeCacheTTL seconds is reused unless useCache is False.\n
         This function is a coroutine\n
         """
-        process : asyncio.subprocess.Process = await asyncio.create_subprocess_shell(self.PING_CMD.format(ip=self.sshAddress[0]),stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-        returncode = await process.wait()
-        return returncode == 0
+        loop = asyncio.get_running_loop()
+        if useCache and self._awake is not None and loop.time() < self._awake[1]:
+            return self._awake[0]
+        with metrics.span("mcconnect_probe_seconds",probe=self.probe) if metrics.instrumentation is not None else metrics.NO_SPAN:
+            awake = await self._probe()
+        self._awake = (awake, loop.time() + self.probeCacheTTL)
+        return awake
+        pass
+
+    async def waitUntilAwake(self, *, timeout : float = 300, pollInterval : float = 2) -> None:
+        """Probes the host every pollInterval seconds until it is awake.\n
+        Raises WakeError if it isn't awake after timeout seconds.\n
+        This function is a coroutine
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not await self.isAwake(useCache=False):
+            if loop.time() + pollInterval > deadline:
+                raise WakeError(f"Host did not wake up within {timeout} seconds")
+            await asyncio.sleep(pollInterval)
+            pass
         pass
 
     async def wakeUp(self) -> int:
@@ -41,9 +239,11 @@ class Connection:
         Returns the status code of the self.wakeCommand specified when creating the Connection object.\n
         This function is a couroutine.\n
         """
-        process : asyncio.subprocess.Process = await asyncio.create_subprocess_shell(self.wakeCommand.format(host=self.sshAddress[0]))
-        
-        return await process.wait()
+        with metrics.span("mcconnect_wake_seconds") if metrics.instrumentation is not None else metrics.NO_SPAN:
+            process : asyncio.subprocess.Process = await asyncio.create_subprocess_shell(self.wakeCommand.format(host=self.sshAddress[0]))
+            
+            returnCode = await process.wait()
+        return returnCode
         pass
 
     async def connect(self) -> asyncssh.SSHClientConnection:
@@ -52,24 +252,49 @@ class Connection:
         Note: This will not work if the host isn't awake.\n
         This function is a couroutine\n
         """
-        if self.disableHostKeyChecking:
-            connection = await asyncssh.connect(self.sshAddress[0],self.sshAddress[1],username=self.username,password=self.password,known_hosts=None)
-        else:
-            connection = await asyncssh.connect(self.sshAddress[0],self.sshAddress[1],username=self.username,password=self.password)
+        with metrics.span("mcconnect_ssh_seconds",operation="connect") if metrics.instrumentation is not None else metrics.NO_SPAN:
+            if self.disableHostKeyChecking:
+                connection = await asyncssh.connect(self.sshAddress[0],self.sshAddress[1],username=self.username,password=self.password,known_hosts=None)
+            else:
+                connection = await asyncssh.connect(self.sshAddress[0],self.sshAddress[1],username=self.username,password=self.password)
         
         self.sshConn = connection
         return self.sshConn
-        
 
-    async def wake(self) -> asyncssh.SSHClientConnection:
+    @property
+    def connected(self) -> bool:
+        return self.sshConn is not None and not self.sshConn.is_closed()
+
+    async def ensureConnected(self) -> asyncssh.SSHClientConnection:
+        """Returns self.sshConn if it is still open and calls self.connect otherwise.\n
+        This function is a coroutine
+        """
+        if self.connected:
+            return self.sshConn
+        return await self.connect()
+
+    async def close(self) -> None:
+        """Closes the SSH connection (and with it the server process, if it still runs).\n
+        This function is a coroutine
+        """
+        if self.sshConn is not None:
+            self.sshConn.close()
+            await self.sshConn.wait_closed()
+        pass
+
+
+    async def wake(self, *, waitUntilReady : bool = False, readyTimeout : float = 300, pollInterval : float = 2) -> asyncssh.SSHClientConnection:
         """Combines self.wakeUp and self.connect.\n
+        If waitUntilReady is True, the host is probed until it is awake before connecting (see self.waitUntilAwake).\n
         Return the new connection\n
-        Raises WakeError if the wake script did not return status code 0\n
+        Raises WakeError if the wake script did not return status code 0 or the host did not wake up in time\n
         This function is a coroutine
         """
         wakeSuccess = await self.wakeUp()
         if wakeSuccess != 0:
             raise WakeError(f"Wake Up could not complete correctly; exited with status code {wakeSuccess}")
+        if waitUntilReady:
+            await self.waitUntilAwake(timeout=readyTimeout,pollInterval=pollInterval)
         
         return await self.connect()
         pass
@@ -84,7 +309,10 @@ class Connection:
         if self.sshConn == None:
             raise ConnectionError("SSH Connection never established; self.sshConn was None")
             return
-        self.serverProcess = await self.sshConn.create_process()
+        with metrics.span("mcconnect_ssh_seconds",operation="start") if metrics.instrumentation is not None else metrics.NO_SPAN:
+            self.serverProcess = await self.sshConn.create_process()
+        if self.log.closed: # Output of an earlier run ended
+            self.log = ServerLog(self.log.lines.maxlen)
         self.writeCommand(self.launchCommand)
         return self.serverProcess
         pass
@@ -112,26 +340,183 @@ class Connection:
     async def shutdown(self) -> None:
         """Sends the specified self.shutdownCommand.\n
         Raises CommandError if the command execution was somehow unsuccessful"""
-        process = await self.sshConn.create_process(encoding="utf-8")
+        process = await (await self.ensureConnected()).create_process(encoding="utf-8") # Reuses the open connection
         process : asyncssh.SSHClientProcess
-        await process.communicate(self.shutdownCommand)
+        with metrics.span("mcconnect_ssh_seconds",operation="shutdown") if metrics.instrumentation is not None else metrics.NO_SPAN:
+            await process.communicate(self.shutdownCommand)
         pass
 
 
-    async def processWatcher(self,process : asyncssh.SSHClientProcess) -> None:
-        """Looks at any data the process receives.
+    async def waitFor(self, pattern : Union[str,re.Pattern], *, timeout : float = None, searchHistory : bool = False) -> re.Match:
+        """Waits for a line of server output matching pattern (e.g. await conn.waitFor(r"Done \\(") to know startup finished).\n
+        Requires processWatcher to run. See ServerLog.waitFor\n
+        This function is a coroutine
         """
-        while True:
-            try:
+        return await self.log.waitFor(pattern,timeout=timeout,searchHistory=searchHistory)
+
+    async def processWatcher(self,process : asyncssh.SSHClientProcess = None) -> None:
+        """Feeds every line of output of process (self.serverProcess by default) into self.log until the output ends or the watcher is cancelled.\n
+        The process is closed afterwards.
+        """
+        if process is None:
+            process = self.serverProcess
+        log = self.log # A later run gets a log of its own
+        try:
+            while True:
                 line = await process.stdout.readline()
-                if line!="":
-                    logging.info(str(("SERVER: "+line).encode("utf-8")))
-                await asyncio.sleep(0)
+                if line == "": # readline only returns an empty string at EOF
+                    break
+                line = line.rstrip("\r\n")
+                logging.info(str(("SERVER: "+line).encode("utf-8")))
+                log.push(line)
                 pass
-            except asyncio.CancelledError:
-                break
-        process.stdin.write_eof()
-        process.stdin.close()
-        process.close()
-        logging.info("Watcher has reached EOF")
-        pass
\ No newline at end of file
+        finally:
+            log.close()
+            process.stdin.write_eof()
+            process.stdin.close()
+            process.close()
+            logging.info("Watcher has reached EOF")
+        pass
+
+class Orchestrator:
+    """Manages a fleet of Connections and runs wake, start, stop, restart and shutdown across many of them at once.\n
+    Connections to the same host (address, port and username) share one SSH connection, over which every process and command runs as its own channel.\n
+    At most concurrency hosts are worked on at the same time. Every operation returns an async iterator yielding a fleet.FleetResult (target being the Connection) as soon as a host is done:
+        async for result in orchestrator.restartAll():
+            print(result.target.sshAddress, "ok" if result.ok else result.error)
+    """
+    def __init__(self, connections : Iterable[Connection], *, concurrency : int = 16):
+        self.connections : list[Connection] = list(connections)
+        self.concurrency = concurrency
+
+        self._sshConns : dict[tuple, asyncssh.SSHClientConnection] = {}
+        self._locks : dict[tuple, asyncio.Lock] = {}
+        self._watchers : dict[Connection, asyncio.Task] = {}
+        pass
+
+    def _lock(self, connection : Connection) -> asyncio.Lock:
+        key = (connection.sshAddress, connection.username)
+        if key not in self._locks:
+            self._locks[key] = asyncio.Lock()
+        return self._locks[key]
+
+    async def connect(self, connection : Connection) -> asyncssh.SSHClientConnection:
+        """Makes sure connection has an open SSH connection, reusing the one of its host if there is one.\n
+        This function is a coroutine
+        """
+        key = (connection.sshAddress, connection.username)
+        async with self._lock(connection):
+            sshConn = self._sshConns.get(key)
+            if sshConn is None or sshConn.is_closed():
+                sshConn = await connection.ensureConnected()
+                self._sshConns[key] = sshConn
+            connection.sshConn = sshConn
+        return sshConn
+
+    def run(self, operation : Callable[[Connection], Awaitable], connections : Iterable[Connection] = None, *, timeout : float = None, retries : int = 0) -> AsyncIterator[FleetResult]:
+        """Runs operation(connection) for every connection (self.connections by default) with the concurrency limit of the orchestrator.\n
+        See fleet.runBounded
+        """
+        return runBounded(operation,self.connections if connections is None else connections,concurrency=self.concurrency,timeout=timeout,retries=retries)
+
+    async def _wake(self, connection : Connection, waitUntilReady : bool, readyTimeout : float) -> asyncssh.SSHClientConnection:
+        async with self._lock(connection): # Hosts shared by several connections are only woken once
+            if not await connection.isAwake(useCache=False):
+                wakeSuccess = await connection.wakeUp()
+                if wakeSuccess != 0:
+                    raise WakeError(f"Wake Up could not complete correctly; exited with status code {wakeSuccess}")
+                if waitUntilReady:
+                    await connection.waitUntilAwake(timeout=readyTimeout)
+            pass
+        return await self.connect(connection)
+
+    async def _retire(self, connection : Connection, timeout : float = 0) -> None:
+        """Cleans up after the previous run of connection once its output ended: forgets its watcher and closes the shell it ran in.\n
+        Waits up to timeout seconds for the output to end. Raises a CommandError if it goes on, as closing the shell would kill a running server.
+        """
+        watcher = self._watchers.get(connection)
+        if watcher is not None:
+            if not watcher.done() and timeout > 0:
+                await asyncio.wait((watcher,),timeout=timeout)
+            if not watcher.done():
+                raise CommandError(f"The server on {connection.sshAddress[0]} is still running; stop it first")
+            await asyncio.gather(self._watchers.pop(connection),return_exceptions=True)
+        elif connection.serverProcess is not None and not connection.serverProcess.is_closing() and connection.serverProcess.returncode is None: # Not started by the orchestrator
+            raise CommandError(f"The server on {connection.sshAddress[0]} is still running; stop it first")
+        if connection.serverProcess is not None:
+            connection.serverProcess.close()
+        pass
+
+    async def _start(self, connection : Connection, readyPattern : str, readyTimeout : float) -> asyncssh.SSHClientProcess:
+        await self.connect(connection)
+        await self._retire(connection)
+        process = await connection.start()
+        self._watchers[connection] = asyncio.ensure_future(connection.processWatcher(process))
+        if readyPattern is not None:
+            await connection.waitFor(readyPattern,timeout=readyTimeout)
+        return process
+
+    async def _stop(self, connection : Connection, stoppedPattern : str, stopTimeout : float) -> None:
+        await connection.stop()
+        connection.serverProcess.stdin.write_eof() # Nothing else to run; the shell exits once the server did
+        if stoppedPattern is None:
+            return
+        await connection.waitFor(stoppedPattern,timeout=stopTimeout)
+        connection.serverProcess.close() # The server is done; end the shell it ran in
+        watcher = self._watchers.pop(connection,None)
+        if watcher is not None:
+            await asyncio.gather(watcher,return_exceptions=True)
+        pass
+
+    async def _restart(self, connection : Connection, readyPattern : str, readyTimeout : float, stoppedPattern : str, stopTimeout : float) -> asyncssh.SSHClientProcess:
+        await self._stop(connection,stoppedPattern,stopTimeout)
+        await self._retire(connection,stopTimeout) # Without a stoppedPattern, wait for the shell to exit instead
+        return await self._start(connection,readyPattern,readyTimeout)
+
+    async def _shutdown(self, connection : Connection) -> None:
+        await self.connect(connection)
+        await connection.shutdown()
+        pass
+
+    def wakeAll(self, connections : Iterable[Connection] = None, *, waitUntilReady : bool = False, readyTimeout : float = 300) -> AsyncIterator[FleetResult]:
+        """Wakes every host that isn't awake and connects to it. See Connection.wake for waitUntilReady"""
+        return self.run(lambda connection: self._wake(connection,waitUntilReady,readyTimeout),connections)
+
+    def startAll(self, connections : Iterable[Connection] = None, *, readyPattern : str = READY_PATTERN, readyTimeout : float = 300) -> AsyncIterator[FleetResult]:
+        """Starts every server and watches its output. A server counts as done once a line matches readyPattern (if not None).\n
+        The shell of an earlier run of a server is closed first once its output ended. A server that is still running is not started again; its result holds a CommandError.
+        """
+        return self.run(lambda connection: self._start(connection,readyPattern,readyTimeout),connections)
+
+    def stopAll(self, connections : Iterable[Connection] = None, *, stoppedPattern : str = STOPPED_PATTERN, stopTimeout : float = 120) -> AsyncIterator[FleetResult]:
+        """Stops every server. A server counts as done once a line matches stoppedPattern (if not None); the shell it ran in is closed then.\n
+        Otherwise the shell exits on its own once the server did.
+        """
+        return self.run(lambda connection: self._stop(connection,stoppedPattern,stopTimeout),connections)
+
+    def restartAll(self, connections : Iterable[Connection] = None, *, readyPattern : str = READY_PATTERN, readyTimeout : float = 300, stoppedPattern : str = STOPPED_PATTERN, stopTimeout : float = 120) -> AsyncIterator[FleetResult]:
+        """Rolling restart: Stops and starts the servers, at most concurrency of them at the same time.\n
+        With stoppedPattern None, a server is started again once the shell of its previous run exited, waiting at most stopTimeout seconds.
+        """
+        return self.run(lambda connection: self._restart(connection,readyPattern,readyTimeout,stoppedPattern,stopTimeout),connections)
+
+    def shutdownAll(self, connections : Iterable[Connection] = None) -> AsyncIterator[FleetResult]:
+        """Shuts down every host"""
+        return self.run(self._shutdown,connections)
+
+    async def close(self) -> None:
+        """Stops watching the servers and closes every SSH connection.\n
+        This function is a coroutine
+        """
+        for watcher in self._watchers.values():
+            watcher.cancel()
+            pass
+        await asyncio.gather(*self._watchers.values(),return_exceptions=True)
+        self._watchers.clear()
+        for sshConn in self._sshConns.values():
+            sshConn.close()
+            pass
+        await asyncio.gather(*(sshConn.wait_closed() for sshConn in self._sshConns.values()),return_exceptions=True)
+        self._sshConns.clear()
+        pass
+    pass
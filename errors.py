@@ -12,4 +12,9 @@ class CommandError(Exception):
 
 class AuthError(Exception):
     """Authentication could not complete properly"""
+    pass
+
+class PacketError(Exception):
+    """Something went wrong with the packet
+    """
     pass
\ No newline at end of file
@@ -0,0 +1,263 @@
+"""Local stand-ins for the query and RCON servers of Minecraft, for testing and benchmarking without a real server.\n
+Both speak the protocols like a vanilla server does and can add latency and drop packets on purpose.
+"""
+
+import asyncio, random, socket
+from typing import Callable
+from mcconnect.errors import *
+from mcconnect.query import CHALLENGE_REQ_TYPE, STAT_REQ_TYPE, FULL_STAT_PADDING, PLAYER_SECTION
+from mcconnect.rcon import RequestTypes, MAX_SC_LENGTH, VANILLA_READ_LENGTH, readPacket
+
+class _FakeQueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server : "FakeQueryServer"):
+        self.server = server
+        self.transport : asyncio.DatagramTransport = None
+        pass
+
+    def connection_made(self, transport):
+        self.transport = transport
+        pass
+
+    def datagram_received(self, data, addr):
+        server = self.server
+        if random.random() < server.loss:
+            return
+        if len(data) < 7 or data[:2] != b"\xFE\xFD":
+            return
+        response = server._respond(data,addr)
+        if response is None:
+            return
+        if server.latency > 0:
+            asyncio.get_running_loop().call_later(server.latency,self.transport.sendto,response,addr)
+        else:
+            self.transport.sendto(response,addr)
+        pass
+    pass
+
+class FakeQueryServer:
+    """A query server answering challenge handshakes, basic and full stats.\n
+    Like a vanilla server, it remembers one challenge token per client address and silently ignores requests with any other token. Tokens expire after tokenLifetime seconds.
+    Stat answers carry the session id of the challenge handshake that handed out the token, not the one of the stat request.\n
+    Every answer is delayed by latency seconds and every incoming packet is dropped with a probability of loss.\n
+    The counters handshakes and stats tell how many requests were answered.\n
+    receiveBuffer sets the size of the kernel receive buffer of the socket, so the server itself doesn't drop requests under load.
+    """
+    def __init__(self, *, motd : str = "A Minecraft Server", gametype : str = "SMP", version : str = "1.16.5", map : str = "world", players : list[str] = None, maxplayers : int = 20, plugins : str = "", latency : float = 0, loss : float = 0, tokenLifetime : float = 30, receiveBuffer : int = 1 << 22):
+        self.motd = motd
+        self.gametype = gametype
+        self.version = version
+        self.map = map
+        self.players : list[str] = list(players) if players is not None else []
+        self.maxplayers = maxplayers
+        self.plugins = plugins
+
+        self.latency = latency
+        self.loss = loss
+        self.tokenLifetime = tokenLifetime
+        self.receiveBuffer = receiveBuffer
+
+        self.handshakes = 0
+        self.stats = 0
+        self.address : tuple[str,int] = None
+        self._tokens : dict[tuple, tuple[int,bytes,float]] = {} # Token, session id of the handshake and expiry per client address
+        self._transport : asyncio.DatagramTransport = None
+        pass
+
+    async def start(self, host : str = "127.0.0.1", port : int = 0) -> tuple[str,int]:
+        """Starts listening and returns the address of the server (a free port is picked if port is 0).\n
+        This function is a coroutine
+        """
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(lambda: _FakeQueryProtocol(self),local_addr=(host,port))
+        if self.receiveBuffer:
+            self._transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,self.receiveBuffer)
+        self.address = self._transport.get_extra_info("sockname")[:2]
+        return self.address
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+        pass
+
+    async def __aenter__(self) -> "FakeQueryServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+        pass
+
+    def _respond(self, data : bytes, addr) -> bytes:
+        requestType = data[2]
+        sessionId = data[3:7]
+        now = asyncio.get_running_loop().time()
+        if requestType == CHALLENGE_REQ_TYPE:
+            token = random.randrange(1 << 24)
+            self._tokens[addr] = (token, sessionId, now + self.tokenLifetime)
+            self.handshakes += 1
+            return bytes([CHALLENGE_REQ_TYPE]) + sessionId + str(token).encode("ascii") + b"\x00"
+        if requestType != STAT_REQ_TYPE or len(data) < 11:
+            return None
+        known = self._tokens.get(addr)
+        if known is None or known[2] < now or known[0] != int.from_bytes(data[7:11],"big"):
+            return None
+        self.stats += 1
+        sessionId = known[1]
+        if len(data) >= 15: # Padded: full stat
+            return bytes([STAT_REQ_TYPE]) + sessionId + self.fullStatPayload()
+        return bytes([STAT_REQ_TYPE]) + sessionId + self.basicStatPayload()
+
+    def basicStatPayload(self) -> bytes:
+        port, ip = self.address[1], self.address[0]
+        fields = (self.motd, self.gametype, self.map, str(len(self.players)), str(self.maxplayers))
+        return b"".join(field.encode("utf-8") + b"\x00" for field in fields) + port.to_bytes(2,"little") + ip.encode("ascii") + b"\x00"
+
+    def fullStatPayload(self) -> bytes:
+        values = {
+            "hostname":self.motd, "gametype":self.gametype, "game_id":"MINECRAFT", "version":self.version,
+            "plugins":self.plugins, "map":self.map, "numplayers":str(len(self.players)), "maxplayers":str(self.maxplayers),
+            "hostport":str(self.address[1]), "hostip":self.address[0]
+        }
+        payload = FULL_STAT_PADDING
+        payload += b"".join(key.encode("utf-8") + b"\x00" + value.encode("utf-8") + b"\x00" for key, value in values.items()) + b"\x00"
+        payload += PLAYER_SECTION
+        payload += b"".join(player.encode("utf-8") + b"\x00" for player in self.players) + b"\x00"
+        return payload
+    pass
+
+def createResponsePacket(reqId : int, type : int, payload : bytes) -> bytes:
+    body = reqId.to_bytes(4,"little",signed=True) + type.to_bytes(4,"little",signed=True) + payload + b"\x00\x00"
+    return len(body).to_bytes(4,"little",signed=True) + body
+
+def echo(command : str) -> str:
+    """The default command handler of FakeRconServer.\n
+    "big <n>" answers with n characters (to test fragmented responses), everything else is echoed back.
+    """
+    if command.startswith("big "):
+        return "x" * int(command[4:])
+    return command
+
+class FakeRconServer:
+    """An RCON server that checks the password and answers commands with handler(command).\n
+    Like a vanilla server, it works through the packets of each connection one at a time, answers packets of unknown types with "Unknown request <type>", and splits responses into packets of at most MAX_SC_LENGTH bytes.
+    With vanillaFraming (the default), it also reads like a vanilla server: at most VANILLA_READ_LENGTH bytes at once, closing the connection unless the read holds exactly one packet. Without it, packets are split by their length prefix, so pipelined clients work.\n
+    Every answer is delayed by latency seconds. With a probability of loss, a command is not answered at all.\n
+    The counters connections and commands tell how much work was done.
+    """
+    def __init__(self, password : str = "test", *, handler : Callable[[str],str] = echo, latency : float = 0, loss : float = 0, vanillaFraming : bool = True):
+        self.password = password
+        self.handler = handler
+        self.latency = latency
+        self.loss = loss
+        self.vanillaFraming = vanillaFraming
+
+        self.connections = 0
+        self.commands = 0
+        self.address : tuple[str,int] = None
+        self._server : asyncio.AbstractServer = None
+        self._writers : set[asyncio.StreamWriter] = set()
+        self._handlers : set[asyncio.Task] = set()
+        pass
+
+    async def start(self, host : str = "127.0.0.1", port : int = 0) -> tuple[str,int]:
+        """Starts listening and returns the address of the server (a free port is picked if port is 0).\n
+        This function is a coroutine
+        """
+        self._server = await asyncio.start_server(self._handle,host,port)
+        self.address = self._server.sockets[0].getsockname()[:2]
+        return self.address
+
+    def close(self) -> None:
+        """Stops listening and closes every connection"""
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+            pass
+        pass
+
+    async def __aenter__(self) -> "FakeRconServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+        await asyncio.gather(*self._handlers,return_exceptions=True) # Let the handlers see their connections end
+        pass
+
+    async def _readPacket(self, reader : asyncio.StreamReader) -> tuple[int,int,memoryview]:
+        if not self.vanillaFraming:
+            return await readPacket(reader)
+        data = await reader.read(VANILLA_READ_LENGTH)
+        if len(data) < 10 or int.from_bytes(data[:4],"little",signed=True) != len(data) - 4: # Vanilla just drops the connection
+            raise PacketError(f"Read of {len(data)} bytes doesn't hold exactly one packet")
+        packet = memoryview(data)
+        return int.from_bytes(packet[4:8],"little",signed=True), int.from_bytes(packet[8:12],"little",signed=True), packet[12:-2]
+
+    async def _handle(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        self.connections += 1
+        self._writers.add(writer)
+        self._handlers.add(asyncio.current_task())
+        authenticated = False
+        try:
+            while True:
+                reqId, type, payload = await self._readPacket(reader)
+                if self.latency > 0:
+                    await asyncio.sleep(self.latency)
+                if type == RequestTypes.LOGIN:
+                    authenticated = bytes(payload).decode("utf-8") == self.password
+                    writer.write(createResponsePacket(reqId if authenticated else -1,RequestTypes.COMMAND,b""))
+                elif not authenticated:
+                    writer.write(createResponsePacket(-1,RequestTypes.COMMAND,b""))
+                elif type == RequestTypes.COMMAND:
+                    self.commands += 1
+                    if random.random() < self.loss:
+                        continue
+                    response = self.handler(bytes(payload).decode("utf-8")).encode("utf-8")
+                    for start in range(0,max(len(response),1),MAX_SC_LENGTH):
+                        writer.write(createResponsePacket(reqId,RequestTypes.RESPONSE,response[start:start+MAX_SC_LENGTH]))
+                        pass
+                else:
+                    writer.write(createResponsePacket(reqId,RequestTypes.RESPONSE,f"Unknown request {hex(type)[2:]}".encode("ascii")))
+                await writer.drain()
+                pass
+        except (asyncio.IncompleteReadError, PacketError, ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+        pass
+    pass
+
+async def main(argv : list[str] = None):
+    """Runs both servers until interrupted and prints their addresses ("query <ip> <port>" and "rcon <ip> <port>")"""
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m mcconnect.fakeservers",description="Local stand-ins for the query and RCON servers of Minecraft")
+    parser.add_argument("--host",default="127.0.0.1")
+    parser.add_argument("--query-port",type=int,default=0)
+    parser.add_argument("--rcon-port",type=int,default=0)
+    parser.add_argument("--password",default="test")
+    parser.add_argument("--latency",type=float,default=0,help="Seconds to delay every answer by")
+    parser.add_argument("--loss",type=float,default=0,help="Probability of dropping a request")
+    args = parser.parse_args(argv)
+
+    queryServer = FakeQueryServer(players=["Steve","Alex"],latency=args.latency,loss=args.loss)
+    rconServer = FakeRconServer(args.password,latency=args.latency,loss=args.loss)
+    queryAddress = await queryServer.start(args.host,args.query_port)
+    rconAddress = await rconServer.start(args.host,args.rcon_port)
+    print("query",*queryAddress,flush=True)
+    print("rcon",*rconAddress,flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        queryServer.close()
+        rconServer.close()
+    pass
+
+if __name__=="__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    pass
@@ -0,0 +1,103 @@
+"""Runs the same operation against many targets (servers, hosts, ...) at once.\n
+The number of operations running at the same time is bounded and results are handed out as soon as each one finishes, so slow or dead targets don't hold back the rest.
+"""
+
+import asyncio, logging
+from typing import AsyncIterator, Awaitable, Callable, Iterable
+from mcconnect.errors import *
+from mcconnect import metrics
+
+RETRY_ON = (ConnectionError, OSError, asyncio.TimeoutError)
+
+class FleetResult:
+    """The outcome of an operation against one target.\n
+    Exactly one of result and error is meaningful: If error is None, the operation succeeded and returned result.
+    """
+    __slots__ = ("target","result","error","attempts")
+
+    def __init__(self, target, result = None, error : BaseException = None, attempts : int = 0):
+        self.target = target
+        self.result = result
+        self.error : BaseException = error
+        self.attempts : int = attempts
+        pass
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        if self.ok:
+            return f"FleetResult(target={self.target!r}, result={self.result!r}, attempts={self.attempts})"
+        return f"FleetResult(target={self.target!r}, error={self.error!r}, attempts={self.attempts})"
+    pass
+
+async def runBounded(operation : Callable[..., Awaitable], targets : Iterable, *, concurrency : int = 64, timeout : float = None, retries : int = 0, retryDelay : float = 0.5, retryOn : tuple = RETRY_ON) -> AsyncIterator[FleetResult]:
+    """Calls operation(target) for every target with at most concurrency calls running at once.\n
+    Yields a FleetResult for every target in the order the operations finish.\n
+    Each attempt is cancelled after timeout seconds (if given). Attempts failing with one of retryOn are repeated up to retries times, waiting retryDelay seconds (doubled after every attempt) in between.\n
+    targets is consumed lazily, so it may be a generator over a very large fleet.\n
+    Leaving the iteration early cancels every operation that is still running.
+    """
+    if concurrency < 1: raise ValueError("concurrency must be at least 1")
+    results : asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+    running : set[asyncio.Task] = set()
+
+    async def run(target) -> None:
+        result = FleetResult(target)
+        try:
+            for attempt in range(retries+1):
+                result.attempts += 1
+                try:
+                    if timeout is None:
+                        result.result = await operation(target)
+                    else:
+                        result.result = await asyncio.wait_for(operation(target),timeout)
+                    result.error = None
+                    break
+                except retryOn as exc:
+                    result.error = exc
+                    if attempt < retries:
+                        logging.debug(f"Attempt {result.attempts} against {target} failed, retrying: {exc!r}")
+                        if metrics.instrumentation is not None:
+                            metrics.increment("mcconnect_fleet_retries_total")
+                        await asyncio.sleep(retryDelay * 2**attempt)
+                    pass
+                except Exception as exc: # Not worth retrying
+                    result.error = exc
+                    break
+                pass
+            results.put_nowait(result)
+        finally:
+            semaphore.release()
+        pass
+
+    async def feed() -> None:
+        try:
+            for target in targets:
+                await semaphore.acquire()
+                task = asyncio.ensure_future(run(target))
+                running.add(task)
+                task.add_done_callback(running.discard)
+                pass
+            await asyncio.gather(*running)
+        finally:
+            results.put_nowait(None) # Nothing will follow
+        pass
+
+    feeder = asyncio.ensure_future(feed())
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            yield result
+            pass
+        await feeder # Raises if iterating over targets failed
+    finally:
+        feeder.cancel()
+        for task in list(running):
+            task.cancel()
+            pass
+    pass
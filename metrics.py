@@ -0,0 +1,248 @@
+"""Instrumentation hooks for query, rcon, slp, monitor and connect.\n
+By default nothing is recorded; the hooks then cost a single attribute check. To record, install an Instrumentation with setInstrumentation:
+    registry = metrics.MetricsRegistry()
+    metrics.setInstrumentation(registry)
+    print(registry.render()) # Prometheus text format
+Any other backend (OpenTelemetry, statsd, ...) can be plugged in by subclassing Instrumentation.\n
+Durations are measured with span, which also hands the start and end of every operation to Instrumentation.startSpan and Instrumentation.endSpan for tracing.\n
+Every hook is only called after checking that metrics.instrumentation is not None (spans fall back to NO_SPAN): calling a hook allocates its keyword arguments, and on hot paths these allocations alone trigger noticeably more garbage collections.\n
+Metrics recorded:
+  + mcconnect_query_seconds{stat}: Duration of query requests (histogram)
+  + mcconnect_query_timeouts_total{stat}: Query requests that got no answer
+  + mcconnect_query_handshakes_total: Challenge handshakes done
+  + mcconnect_query_handshake_seconds: Duration of challenge handshakes (histogram)
+  + mcconnect_query_token_rejections_total: Requests that were repeated because a cached challenge token was rejected
+  + mcconnect_parse_seconds{stat}: Time spent parsing responses (histogram)
+  + mcconnect_bytes_sent_total{protocol} and mcconnect_bytes_received_total{protocol}
+  + mcconnect_fleet_retries_total: Retried fleet operations
+  + mcconnect_rcon_command_seconds: Duration of RCON commands (histogram)
+  + mcconnect_rcon_fragments: Packets per RCON response (histogram)
+  + mcconnect_rcon_queue_depth{server,priority}: Commands waiting in an rcon.RconScheduler (gauge)
+  + mcconnect_rcon_queue_seconds{server,priority}: Time commands waited in an RconScheduler (histogram)
+  + mcconnect_rcon_dropped_total{server,priority}: Commands an RconScheduler dropped because their deadline passed
+  + mcconnect_slp_seconds: Duration of Server List Pings (histogram)
+  + mcconnect_monitor_events_total{type}: Events emitted by monitor.Monitor
+  + mcconnect_ssh_seconds{operation}: Duration of the SSH operations of connect.Connection: connect, start and shutdown (histogram)
+  + mcconnect_wake_seconds: Duration of connect.Connection.wakeUp's local wake command (histogram)
+  + mcconnect_probe_seconds{probe}: Duration of connect.Connection's awake probes (histogram)
+"""
+
+import asyncio, logging, time
+from typing import Iterable
+
+LATENCY_BUCKETS  = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+FRAGMENT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+class Instrumentation:
+    """Receives every measurement. Subclass it and override observe, increment and gauge to send them anywhere.\n
+    labels is a dictionary of strings describing the measurement further (e.g. {"stat":"full"}).
+    """
+    def observe(self, name : str, value : float, labels : dict[str,str]) -> None:
+        """A single measurement of a distribution, e.g. a duration in seconds"""
+        pass
+
+    def increment(self, name : str, amount : float, labels : dict[str,str]) -> None:
+        """Increases a counter"""
+        pass
+
+    def gauge(self, name : str, value : float, labels : dict[str,str]) -> None:
+        """Sets a gauge, a value that can go up and down (e.g. a queue length)"""
+        pass
+
+    def startSpan(self, name : str, labels : dict[str,str]):
+        """An operation started, e.g. a query request. Whatever is returned (e.g. a tracing span) is passed to endSpan."""
+        return None
+
+    def endSpan(self, span, error : BaseException) -> None:
+        """The operation span was returned for ended. error is the exception it ended with, or None if it succeeded."""
+        pass
+    pass
+
+instrumentation : Instrumentation = None
+
+def setInstrumentation(new : Instrumentation) -> None:
+    """Installs new as the receiver of every measurement. None turns recording off."""
+    global instrumentation
+    instrumentation = new
+    pass
+
+def observe(name : str, value : float, **labels : str) -> None:
+    if instrumentation is not None:
+        instrumentation.observe(name,value,labels)
+    pass
+
+def increment(name : str, amount : float = 1, **labels : str) -> None:
+    if instrumentation is not None:
+        instrumentation.increment(name,amount,labels)
+    pass
+
+def gauge(name : str, value : float, **labels : str) -> None:
+    if instrumentation is not None:
+        instrumentation.gauge(name,value,labels)
+    pass
+
+class Span:
+    """Measures the duration of an operation, created by span.\n
+    If the operation succeeds, its duration is observed under its name; either way, its end is passed to Instrumentation.endSpan.
+    """
+    __slots__ = ("instrumentation","name","labels","started","span")
+
+    def __init__(self, instrumentation : Instrumentation, name : str, labels : dict[str,str]):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.labels = labels
+        self.started : float = None
+        self.span = None
+        pass
+
+    def __enter__(self) -> "Span":
+        self.span = self.instrumentation.startSpan(self.name,self.labels)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, exc, traceback) -> bool:
+        if exc is None:
+            self.instrumentation.observe(self.name,time.perf_counter() - self.started,self.labels)
+        self.instrumentation.endSpan(self.span,exc)
+        return False
+    pass
+
+class _NoSpan:
+    """Does nothing; used while no Instrumentation is installed"""
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, excType, exc, traceback) -> bool:
+        return False
+    pass
+
+NO_SPAN = _NoSpan()
+
+def span(name : str, **labels : str) -> Span:
+    """Returns a context manager measuring the operation it wraps; name is the histogram its duration goes to.\n
+    Usage: with metrics.span("mcconnect_query_seconds",stat="full"): ...\n
+    While nothing is installed, NO_SPAN is returned, so not even the clock is read.
+    """
+    if instrumentation is None:
+        return NO_SPAN
+    return Span(instrumentation,name,labels)
+
+class _Histogram:
+    __slots__ = ("buckets","counts","sum","count")
+
+    def __init__(self, buckets : tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        pass
+
+    def add(self, value : float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+            pass
+        self.sum += value
+        self.count += 1
+        pass
+    pass
+
+def _escape(value) -> str:
+    return str(value).replace("\\","\\\\").replace('"','\\"').replace("\n","\\n")
+
+def _formatLabels(labels : Iterable[tuple[str,str]], le : str = None) -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if len(parts) > 0 else ""
+
+class MetricsRegistry(Instrumentation):
+    """Keeps counters and histograms in memory and renders them in the Prometheus text format.\n
+    buckets maps metric names to the upper bounds of their histogram buckets; LATENCY_BUCKETS is used for every other histogram.
+    """
+    def __init__(self, buckets : dict[str,tuple] = None):
+        self.buckets = {"mcconnect_rcon_fragments":FRAGMENT_BUCKETS}
+        self.buckets |= buckets or {}
+        self.counters : dict[str, dict[tuple, float]] = {}
+        self.gauges : dict[str, dict[tuple, float]] = {}
+        self.histograms : dict[str, dict[tuple, _Histogram]] = {}
+        self._server : asyncio.AbstractServer = None
+        pass
+
+    def observe(self, name : str, value : float, labels : dict[str,str]) -> None:
+        series = self.histograms.setdefault(name,{})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = _Histogram(self.buckets.get(name,LATENCY_BUCKETS))
+        histogram.add(value)
+        pass
+
+    def increment(self, name : str, amount : float, labels : dict[str,str]) -> None:
+        series = self.counters.setdefault(name,{})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key,0) + amount
+        pass
+
+    def gauge(self, name : str, value : float, labels : dict[str,str]) -> None:
+        self.gauges.setdefault(name,{})[tuple(sorted(labels.items()))] = value
+        pass
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format"""
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_formatLabels(labels)} {value:g}")
+                pass
+            pass
+        for name, series in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in series.items():
+                lines.append(f"{name}{_formatLabels(labels)} {value:g}")
+                pass
+            pass
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets,histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_formatLabels(labels,format(bound,'g'))} {cumulative}")
+                    pass
+                lines.append(f"{name}_bucket{_formatLabels(labels,'+Inf')} {histogram.count}")
+                lines.append(f"{name}_sum{_formatLabels(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{_formatLabels(labels)} {histogram.count}")
+                pass
+            pass
+        return "\n".join(lines) + "\n"
+
+    async def _answer(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n") # Whatever was asked for, the answer is the same
+            body = self.render().encode("utf-8")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: " + str(len(body)).encode("ascii") + b"\r\nConnection: close\r\n\r\n" + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionResetError) as exc:
+            logging.debug(f"Metrics request failed: {exc!r}")
+        finally:
+            writer.close()
+        pass
+
+    async def serve(self, host : str = "127.0.0.1", port : int = 9464) -> tuple[str,int]:
+        """Starts a tiny HTTP server that answers every request with self.render(), for Prometheus to scrape. Returns its address.\n
+        This function is a coroutine
+        """
+        self._server = await asyncio.start_server(self._answer,host,port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    def close(self) -> None:
+        """Stops the HTTP server started by MetricsRegistry.serve"""
+        if self._server is not None:
+            self._server.close()
+        pass
+    pass
@@ -0,0 +1,286 @@
+"""Watches servers via the query protocol and reports what changed instead of whole snapshots.\n
+Usage:
+    async with Monitor([("play.example.org",25565)]) as monitor:
+        async for event in monitor.subscribe():
+            print(event)
+"""
+
+import asyncio, logging, inspect
+from typing import Awaitable, Callable, Iterable, Union
+from mcconnect.errors import *
+from mcconnect import metrics
+from mcconnect.query import QueryClient, QueryConnection, FullStat
+from mcconnect.subscription import Subscription
+
+WATCHED_FIELDS = ("hostname","version","map","gametype","maxplayers","pluginhost","plugins")
+
+class EventTypes:
+    JOIN    = "join"    # new is the name of the player
+    LEAVE   = "leave"   # old is the name of the player
+    CHANGE  = "change"  # field, old and new tell what changed
+    OFFLINE = "offline" # old is the last known FullStat (None if the server was never seen online)
+    ONLINE  = "online"  # new is the current FullStat
+
+class Event:
+    """Something that changed on server (an (ip, port) tuple). See EventTypes for the meaning of old and new."""
+    __slots__ = ("type","server","field","old","new")
+
+    def __init__(self, type : str, server : tuple[str,int], *, field : str = None, old = None, new = None):
+        self.type = type
+        self.server = server
+        self.field = field
+        self.old = old
+        self.new = new
+        pass
+
+    def __repr__(self) -> str:
+        description = f"<Event {self.type} {self.server[0]}:{self.server[1]}"
+        if self.type == EventTypes.JOIN:
+            description += f" {self.new!r}"
+        elif self.type == EventTypes.LEAVE:
+            description += f" {self.old!r}"
+        elif self.type == EventTypes.CHANGE:
+            description += f" {self.field}: {self.old!r} -> {self.new!r}"
+        return description + ">"
+    pass
+
+def diff(server : tuple[str,int], old : FullStat, new : FullStat, fields : Iterable[str] = WATCHED_FIELDS) -> list[Event]:
+    """Compares two full stats of server and returns the events that lead from old to new"""
+    events = []
+    oldPlayers = set(old.players)
+    newPlayers = set(new.players)
+    for player in new.players:
+        if player not in oldPlayers:
+            events.append(Event(EventTypes.JOIN,server,new=player))
+        pass
+    for player in old.players:
+        if player not in newPlayers:
+            events.append(Event(EventTypes.LEAVE,server,old=player))
+        pass
+    for field in fields:
+        if old.get(field) != new.get(field):
+            events.append(Event(EventTypes.CHANGE,server,field=field,old=old.get(field),new=new.get(field)))
+        pass
+    return events
+
+class EventSubscription(Subscription[Event]):
+    """A subscription.Subscription to the events a Monitor emits, created by Monitor.subscribe.\n
+    A consumer falling behind by more than maxsize events loses the oldest ones instead of slowing down the monitor. The iteration ends when the monitor or the subscription is closed.
+    """
+    def __init__(self, monitor : "Monitor", maxsize : int):
+        super().__init__(monitor._subscriptions,maxsize)
+        self.monitor = monitor
+        pass
+    pass
+
+class _ServerState:
+    __slots__ = ("connection","stat","online","failures","interval","task")
+
+    def __init__(self, connection : QueryConnection, interval : float):
+        self.connection = connection
+        self.stat : FullStat = None # Last stat the server answered with
+        self.online : bool = None # Unknown until the first poll
+        self.failures = 0
+        self.interval = interval
+        self.task : asyncio.Task = None
+        pass
+    pass
+
+class Monitor:
+    """Polls the full stat of every server in targets ((ip, port) tuples) and emits an Event for every change: players joining and leaving, changes of the fields in watch (the MOTD is called hostname in full stats), and the server going offline or coming back online.\n
+    The first successful poll of a server emits an online event with the current stat; after that, only changes are emitted.
+    A server counts as offline after offlineAfter polls in a row got no answer, as single UDP packets get lost now and then.\n
+    Servers are polled every interval seconds at first. Every poll without changes multiplies the interval by backoff, up to maxInterval; any change resets it. Servers that are empty or offline are polled every maxInterval seconds.\n
+    Events are handed to every callback (plain functions or coroutine functions, see Monitor.addCallback) and every subscription (see Monitor.subscribe).\n
+    At most concurrency polls run at once; they share client (a QueryClient is created if none is given).
+    """
+    def __init__(self, targets : Iterable[tuple[str,int]] = (), *, interval : float = 5, maxInterval : float = 60, backoff : float = 1.5, timeout : float = 5, offlineAfter : int = 2, watch : Iterable[str] = WATCHED_FIELDS, concurrency : int = 64, client : QueryClient = None):
+        if interval <= 0 or maxInterval < interval: raise ValueError("interval must be positive and at most maxInterval")
+        self.interval = interval
+        self.maxInterval = maxInterval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.offlineAfter = offlineAfter
+        self.watch = tuple(watch)
+        self.concurrency = concurrency
+
+        self.client = client
+        self._ownsClient = client is None
+        self._servers : dict[tuple[str,int], _ServerState] = {}
+        self._callbacks : list[Callable[[Event], Union[None,Awaitable]]] = []
+        self._subscriptions : set[EventSubscription] = set()
+        self._callbackTasks : set[asyncio.Task] = set() # Keeps running callbacks from being garbage collected
+        self._semaphore : asyncio.Semaphore = None
+        self.running = False
+        for target in targets:
+            self.add(target)
+            pass
+        pass
+
+    @property
+    def servers(self) -> dict[tuple[str,int], FullStat]:
+        """The last known stat of every server (None if it never answered)"""
+        return {server:state.stat for server, state in self._servers.items()}
+
+    def online(self, server : tuple[str,int]) -> bool:
+        """Whether server answered the last polls (None if it wasn't polled yet)"""
+        return self._servers[(server[0],server[1])].online
+
+    def add(self, server : tuple[str,int]) -> None:
+        """Starts watching server. Does nothing if it is watched already."""
+        server = (server[0],server[1])
+        if server in self._servers:
+            return
+        state = _ServerState(QueryConnection(server[0],server[1],self.timeout,client=self.client),self.interval)
+        self._servers[server] = state
+        if self.running:
+            state.task = asyncio.ensure_future(self._watch(server,state))
+        pass
+
+    def remove(self, server : tuple[str,int]) -> None:
+        """Stops watching server. No events are emitted for it any more."""
+        state = self._servers.pop((server[0],server[1]),None)
+        if state is not None and state.task is not None:
+            state.task.cancel()
+        pass
+
+    def addCallback(self, callback : Callable[[Event], Union[None,Awaitable]]) -> None:
+        """Calls callback with every event. If it returns an awaitable, it is run as a task so the monitor doesn't wait for it."""
+        self._callbacks.append(callback)
+        pass
+
+    def removeCallback(self, callback : Callable[[Event], Union[None,Awaitable]]) -> None:
+        self._callbacks.remove(callback)
+        pass
+
+    def subscribe(self, maxsize : int = 10000) -> EventSubscription:
+        """Returns an EventSubscription that receives every event emitted from now on.\n
+        Usage: async for event in monitor.subscribe(): ...
+        """
+        subscription = EventSubscription(self,maxsize)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def _emit(self, event : Event) -> None:
+        if metrics.instrumentation is not None:
+            metrics.increment("mcconnect_monitor_events_total",type=event.type)
+        for callback in list(self._callbacks):
+            try:
+                result = callback(event)
+                if inspect.isawaitable(result):
+                    task = asyncio.ensure_future(result)
+                    self._callbackTasks.add(task)
+                    task.add_done_callback(self._callbackTasks.discard)
+            except Exception:
+                logging.exception(f"Monitor callback {callback!r} failed on {event!r}")
+            pass
+        for subscription in list(self._subscriptions):
+            subscription._put(event)
+            pass
+        pass
+
+    async def poll(self, server : tuple[str,int]) -> list[Event]:
+        """Polls server once, emits the events and returns them. Also adjusts the poll interval of the server.\n
+        This function is a coroutine
+        """
+        server = (server[0],server[1])
+        state = self._servers[server]
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                stat = await state.connection.fullStat()
+            except (ConnectionError, PacketError, OSError) as exc:
+                logging.debug(f"Polling {server} failed: {exc!r}")
+                stat = None
+            except Exception: # A bug must not end the watch of the server; count it as a failed poll
+                logging.exception(f"Polling {server} failed unexpectedly")
+                stat = None
+            pass
+
+        events = []
+        if stat is None:
+            state.failures += 1
+            if state.failures >= self.offlineAfter and state.online is not False:
+                state.online = False
+                events.append(Event(EventTypes.OFFLINE,server,old=state.stat))
+            if state.online is False:
+                state.interval = self.maxInterval
+        else:
+            state.failures = 0
+            if state.online is not True:
+                state.online = True
+                events.append(Event(EventTypes.ONLINE,server,new=stat))
+                if state.stat is not None: # Report what changed while it was offline
+                    events += diff(server,state.stat,stat,self.watch)
+            else:
+                events += diff(server,state.stat,stat,self.watch)
+            state.stat = stat
+            if len(events) > 0:
+                state.interval = self.interval
+            elif stat.numplayers == 0:
+                state.interval = self.maxInterval
+            else:
+                state.interval = min(state.interval*self.backoff,self.maxInterval)
+            pass
+
+        if self._servers.get(server) is state: # Removed while polling
+            for event in events:
+                self._emit(event)
+                pass
+        return events
+
+    async def _watch(self, server : tuple[str,int], state : _ServerState):
+        while self._servers.get(server) is state: # Until it is removed
+            await self.poll(server)
+            await asyncio.sleep(state.interval)
+            pass
+        pass
+
+    async def start(self) -> None:
+        """Starts polling every server in the background.\n
+        This function is a coroutine
+        """
+        if self.running:
+            return
+        if self.client is None:
+            self.client = QueryClient()
+            for state in self._servers.values():
+                state.connection.client = self.client
+                pass
+        await self.client.start()
+        self.running = True
+        for server, state in self._servers.items():
+            state.task = asyncio.ensure_future(self._watch(server,state))
+            pass
+        pass
+
+    async def close(self) -> None:
+        """Stops polling and ends every subscription. The QueryClient is closed too if the monitor created it.\n
+        This function is a coroutine
+        """
+        self.running = False
+        tasks = [state.task for state in self._servers.values() if state.task is not None]
+        for task in tasks:
+            task.cancel()
+            pass
+        await asyncio.gather(*tasks,return_exceptions=True)
+        for state in self._servers.values():
+            state.task = None
+            pass
+        for subscription in list(self._subscriptions):
+            subscription.close()
+            pass
+        if self._ownsClient and self.client is not None:
+            self.client.close()
+            self.client = None
+        pass
+
+    async def __aenter__(self) -> "Monitor":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+        pass
+    pass
@@ -3,58 +3,56 @@ This library provides handling for the query protocol of Minecraft used to get d
 For information on how this protocol works, visit https://wwww.wiki.vg/Query (not my page)
 """
 
-import asyncio, random, logging
-if __name__!="__main__": from mcconnect.errors import *
-else: from errors import *
+import asyncio, random, logging, socket
+from collections.abc import Mapping
+from typing import AsyncIterator, Iterable
+from mcconnect.errors import *
+from mcconnect.fleet import FleetResult, runBounded
+from mcconnect.cache import TTLCache
+from mcconnect import metrics
 
 CHALLENGE_REQ_TYPE = 0x09
 STAT_REQ_TYPE      = 0x00
 
+TOKEN_LIFETIME = 25 # The server forgets its challenge tokens after 30 to 60 seconds; stay safely below that
+
 class __QueryProtocol__(asyncio.DatagramProtocol):
-    """The asyncio.BaseProtocol adaptation for the QueryConnection class.\n
-    This shouldn't be initialised outside of the QueryConnection.
+    """The asyncio.BaseProtocol adaptation for the QueryClient class.\n
+    Every socket owned by a QueryClient uses one of these. Incoming datagrams are routed to the request waiting for their (address, session id, type).\n
+    A vanilla server answers stat requests with the session id of the challenge handshake that handed out the token, not with the one of the request. All stat answers of a server to one socket carry the same session id, so only one stat request per server runs on a socket at a time.\n
+    This shouldn't be initialised outside of the QueryClient.
     """
-    def __init__(self, sessionId : int, isFullStat : bool,conv_finished : asyncio.Future, addr : tuple[str,int]):
+    def __init__(self, client : "QueryClient"):
         super().__init__()
-        self.sessionId  : int  = sessionId
-        self.isFullStat : bool = isFullStat
-        self.challengeToken : int = None
-        self.result = b""
-
-        self.transport = None
-        self.conv_finished : asyncio.Future = conv_finished
-
-        self.addr = addr
+        self.client = client
+        self.transport : asyncio.DatagramTransport = None
+        self.pending : dict[tuple[str,int,int,int], asyncio.Future] = {} # Requests waiting for an answer per (ip, port, session id, type)
+        self.handshakes : dict[tuple[str,int], asyncio.Task] = {} # Running challenge token requests per server
+        self.tokens : dict[tuple[str,int], tuple[int,int,float]] = {} # Challenge token, session id of its handshake and expiry time per server
+        self.exchanges : dict[tuple[str,int], tuple[bool,asyncio.Task]] = {} # Running stat request per server and whether it is a full stat
         pass
+
     def connection_made(self,transport : asyncio.DatagramTransport):
         self.transport = transport # Saves the transport that was created to be used later
-        transport.sendto(createQueryPacket(self.sessionId,CHALLENGE_REQ_TYPE,b""),self.addr) # Send a challenge token request
-        
         pass
 
     def datagram_received(self,data,addr):
-        logging.debug(f"Data received: {data}")
+        logging.debug(f"Data received from {addr}: {data}")
+        if metrics.instrumentation is not None:
+            metrics.increment("mcconnect_bytes_received_total",len(data),protocol="query")
+        if len(data) < 5: # Too short to even contain a header; nobody can be waiting for this
+            return
         respType = data[0] # Get type in the response
         sessionId = int.from_bytes(data[1:5],"big") # Get & Decode the session Id
-        if sessionId != self.sessionId: # Protect against potential leaks from other sources
-            raise ValueError
-        if respType == CHALLENGE_REQ_TYPE: # If received data is in response to a token request do this
-            challengeToken = int(data[5:-1]) # Get token from data
-            self.challengeToken = challengeToken # Safe token in the protocol
-            # Send actual query with the new challenge token. 
-            requestPayload = self.challengeToken.to_bytes(4,"big")
-            requestPayload += b"\x00"*4 if self.isFullStat else b"" # Add required padding if a full stat is wanted
-
-            self.transport.sendto(createQueryPacket(self.sessionId,STAT_REQ_TYPE,requestPayload),self.addr) # Send the query
-            pass
-        else: # If result from query is received
-            self.result = data
-            self.conv_finished.set_result(data)
+        future = self.pending.get((addr[0],addr[1],sessionId,respType))
+        if future is None: # Late answer, answer to a timed out request or a packet from some other source
+            return
+        if not future.done():
+            future.set_result(data)
         pass
 
-    def error_received(self,data):
-        logging.error(f"Error with UDP Connection: {data}")
-        self.conv_finished.set_exception(ConnectionError("Could not connect to the Server specified."))
+    def error_received(self,exc):
+        logging.error(f"Error with UDP Connection: {exc}")
         pass
 
     def connection_lost(self,exc):
@@ -76,16 +74,396 @@ def createSessionId():
     return eval(sessionId)
     pass
 
+class QueryClient:
+    """Owns a small pool of UDP sockets that any number of queries can share.\n
+    Responses are demultiplexed by (server ip, port, session id), so thousands of requests to different servers can be in flight at once without opening a socket for each of them.
+    The stat answers of one server to one socket can't be told apart, so requests to the same server run one at a time per socket; concurrent requests for the same kind of stat share one answer. Use more sockets to query a single server in parallel.\n
+    The sockets are opened on first use (or by QueryClient.start) and closed by QueryClient.close. The client can also be used as an async context manager.
+    Host names are resolved on every request; IPv6 sockets are opened when the first IPv6 server is queried.\n
+    receiveBuffer sets the size of the kernel receive buffer of each socket (capped by the OS). Many answers arriving at once are dropped if it is too small.\n
+    \n
+    Challenge tokens are cached per server for tokenLifetime seconds, so a request to a recently queried server only needs a single round trip.
+    The server silently drops requests with a token it no longer accepts. If there is no answer to a request with a cached token after rejectTimeout seconds, the handshake is redone and the request sent again.
+    """
+    def __init__(self, sockets : int = 1, *, receiveBuffer : int = 1 << 20, tokenLifetime : float = TOKEN_LIFETIME, rejectTimeout : float = 1):
+        if sockets < 1: raise ValueError("A QueryClient needs at least one socket")
+        self.socketCount = sockets
+        self.receiveBuffer = receiveBuffer
+        self.tokenLifetime = tokenLifetime
+        self.rejectTimeout = rejectTimeout
+
+        self._protocols : dict[int, list[__QueryProtocol__]] = {} # Sockets per address family
+        self._nextProtocol = 0
+        self._startLock : asyncio.Lock = None
+        pass
+
+    @property
+    def closed(self) -> bool:
+        return len(self._protocols) == 0
+
+    async def _open(self, family : int) -> list[__QueryProtocol__]:
+        """Returns the sockets for family (socket.AF_INET or socket.AF_INET6), opening them if needed"""
+        protocols = self._protocols.get(family)
+        if protocols is not None:
+            return protocols
+        if self._startLock is None:
+            self._startLock = asyncio.Lock()
+        async with self._startLock:
+            protocols = self._protocols.get(family)
+            if protocols is not None:
+                return protocols
+            loop = asyncio.get_running_loop()
+            protocols = []
+            for _ in range(self.socketCount):
+                transport, protocol = await loop.create_datagram_endpoint(lambda: __QueryProtocol__(self), local_addr=("::" if family == socket.AF_INET6 else "0.0.0.0",0), family=family)
+                if self.receiveBuffer:
+                    transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,self.receiveBuffer)
+                protocols.append(protocol)
+                pass
+            self._protocols[family] = protocols
+            return protocols
+
+    async def start(self) -> None:
+        """Opens the (IPv4) sockets of this client. Calling this on a started client does nothing.\n
+        This function is a coroutine
+        """
+        await self._open(socket.AF_INET)
+        pass
+
+    def close(self) -> None:
+        """Closes every socket of this client. Queries that are still waiting fail with a ConnectionError.
+        """
+        protocols = [protocol for familyProtocols in self._protocols.values() for protocol in familyProtocols]
+        self._protocols = {}
+        for protocol in protocols:
+            protocol.transport.close()
+            for future in protocol.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("The query client was closed"))
+                pass
+            protocol.pending.clear()
+            pass
+        pass
+
+    async def __aenter__(self) -> "QueryClient":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+        pass
+
+    async def _resolve(self, addr : tuple[str,int]) -> tuple[int,tuple[str,int]]:
+        """Returns the address family and the numeric (ip, port) of addr, resolving host names.\n
+        Responses come from numeric addresses, so requests have to be keyed by them too.
+        """
+        host, port = addr[0], addr[1]
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                return family, (socket.inet_ntop(family,socket.inet_pton(family,host)), port) # Normalised like the addresses of incoming datagrams
+            except OSError: # Not a numeric address of this family
+                pass
+            pass
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host,port,type=socket.SOCK_DGRAM)
+        except socket.gaierror as exc:
+            raise ConnectionError(f"Could not resolve {host}: {exc}") from None
+        family, _, _, _, sockaddr = infos[0]
+        return family, (sockaddr[0], sockaddr[1])
+
+    async def _protocolFor(self, addr : tuple[str,int]) -> tuple[__QueryProtocol__,tuple[str,int]]:
+        """Resolves addr and picks the socket to reach it with. Returns the socket's protocol and the numeric address."""
+        family, addr = await self._resolve(addr)
+        protocols = await self._open(family)
+        protocol = protocols[self._nextProtocol % len(protocols)] # Spread the requests over the sockets
+        self._nextProtocol += 1
+        return protocol, addr
+
+    async def _send(self, protocol : __QueryProtocol__, addr : tuple[str,int], sessionId : int, type : int, payload : bytes) -> bytes:
+        """Sends a single query packet and waits for the answer of the same type and session id."""
+        future = asyncio.get_running_loop().create_future()
+        key = (addr[0],addr[1],sessionId,type)
+        protocol.pending[key] = future
+        packet = createQueryPacket(sessionId,type,payload)
+        protocol.transport.sendto(packet,addr)
+        if metrics.instrumentation is not None:
+            metrics.increment("mcconnect_bytes_sent_total",len(packet),protocol="query")
+        try:
+            return await future
+        finally:
+            if protocol.pending.get(key) is future:
+                del protocol.pending[key]
+        pass
+
+    async def _handshake(self, protocol : __QueryProtocol__, addr : tuple[str,int], sessionId : int = None) -> tuple[int,int]:
+        if sessionId is None:
+            sessionId = createSessionId()
+        if metrics.instrumentation is not None:
+            metrics.increment("mcconnect_query_handshakes_total")
+        with metrics.span("mcconnect_query_handshake_seconds") if metrics.instrumentation is not None else metrics.NO_SPAN:
+            response = await self._send(protocol,addr,sessionId,CHALLENGE_REQ_TYPE,b"") # Request a challenge token
+        try:
+            challengeToken = int(response[5:].rstrip(b"\x00")) # Get token from data
+        except ValueError:
+            raise PacketError(f"Invalid challenge token from {addr[0]}:{addr[1]}: {response[5:]!r}") from None
+        protocol.tokens[addr] = (challengeToken, sessionId, asyncio.get_running_loop().time() + self.tokenLifetime)
+        return challengeToken, sessionId
+
+    async def _challenge(self, protocol : __QueryProtocol__, addr : tuple[str,int], timeout : float, *, rejected : int = None, sessionId : int = None) -> tuple[int,int,bool]:
+        """Gets a challenge token for addr that is valid on the socket of protocol.\n
+        Returns the token, the session id of the handshake it came from and whether it came from the cache. A cached token equal to rejected is never used.
+        A new handshake uses sessionId if given.\n
+        The server only remembers the latest token it handed to a socket, so concurrent requests share a single handshake.
+        """
+        cached = protocol.tokens.get(addr)
+        if cached is not None:
+            challengeToken, tokenSessionId, expiry = cached
+            if challengeToken != rejected and asyncio.get_running_loop().time() < expiry:
+                return challengeToken, tokenSessionId, True
+            del protocol.tokens[addr]
+            pass
+
+        handshake = protocol.handshakes.get(addr)
+        if handshake is None:
+            handshake = asyncio.ensure_future(asyncio.wait_for(self._handshake(protocol,addr,sessionId),timeout))
+            protocol.handshakes[addr] = handshake
+            def forget(task : asyncio.Task):
+                if protocol.handshakes.get(addr) is task:
+                    del protocol.handshakes[addr]
+                if not task.cancelled():
+                    task.exception() # Mark the exception as retrieved in case every requester gave up
+                pass
+            handshake.add_done_callback(forget)
+            pass
+        challengeToken, tokenSessionId = await asyncio.shield(handshake) # One requester timing out must not cancel the handshake for the others
+        return challengeToken, tokenSessionId, False
+
+    async def _exchange(self, protocol : __QueryProtocol__, addr : tuple[str,int], isFullStat : bool, sessionId : int, timeout : float) -> bytes:
+        """Sends a stat request with the token of the latest handshake on the socket of protocol, and with that handshake's session id, which the server answers with."""
+        challengeToken, sessionId, cached = await self._challenge(protocol,addr,timeout,sessionId=sessionId)
+        padding = b"\x00"*4 if isFullStat else b"" # Add required padding if a full stat is wanted
+
+        if cached:
+            try:
+                return await asyncio.wait_for(self._send(protocol,addr,sessionId,STAT_REQ_TYPE,challengeToken.to_bytes(4,"big",signed=True) + padding),self.rejectTimeout)
+            except asyncio.TimeoutError: # The token most likely expired early; get a new one
+                logging.debug(f"No answer with cached challenge token from {addr}, redoing handshake")
+                if metrics.instrumentation is not None:
+                    metrics.increment("mcconnect_query_token_rejections_total")
+                challengeToken, sessionId, cached = await self._challenge(protocol,addr,timeout,rejected=challengeToken)
+            pass
+        return await self._send(protocol,addr,sessionId,STAT_REQ_TYPE,challengeToken.to_bytes(4,"big",signed=True) + padding) # Send the actual query
+
+    async def _stat(self, protocol : __QueryProtocol__, addr : tuple[str,int], isFullStat : bool, sessionId : int, timeout : float) -> bytes:
+        """Runs a stat request against addr on the socket of protocol.\n
+        The answers of a server to one socket can't be told apart, so only one stat request per server runs on a socket at a time. Concurrent requests for the same kind of stat share it; the other kind waits for it to finish.
+        """
+        while True:
+            running = protocol.exchanges.get(addr)
+            if running is None:
+                break
+            runningIsFullStat, exchange = running
+            if runningIsFullStat == isFullStat:
+                return await asyncio.shield(exchange)
+            await asyncio.wait((exchange,))
+            pass
+
+        exchange = asyncio.ensure_future(asyncio.wait_for(self._exchange(protocol,addr,isFullStat,sessionId,timeout),timeout))
+        protocol.exchanges[addr] = (isFullStat, exchange)
+        def forget(task : asyncio.Task):
+            running = protocol.exchanges.get(addr)
+            if running is not None and running[1] is task:
+                del protocol.exchanges[addr]
+            if not task.cancelled():
+                task.exception() # Mark the exception as retrieved in case every requester gave up
+            pass
+        exchange.add_done_callback(forget)
+        return await asyncio.shield(exchange) # One requester timing out must not cancel the request for the others
+
+    async def ping(self, addr : tuple[str,int], *, timeout : float = 5) -> float:
+        """Does a fresh challenge handshake with the server at addr and returns the round trip time in seconds.\n
+        Raises a ConnectionError if the server did not answer within timeout seconds.\n
+        This function is a coroutine
+        """
+        protocol, addr = await self._protocolFor(addr)
+        cached = protocol.tokens.get(addr)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await asyncio.wait_for(self._challenge(protocol,addr,timeout,rejected=cached[0] if cached is not None else None),timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError("Could not connect to the server") from None
+        return loop.time() - started
+
+    async def query(self, addr : tuple[str,int], isFullStat : bool, *, sessionId : int = None, timeout : float = 30) -> bytes:
+        """Runs a complete stat request against the server at addr and returns the raw response.\n
+        The given sessionId is used for the challenge handshake if one is needed. The server answers every stat request sent with the resulting token with it.\n
+        Raises a ConnectionError if the server did not answer within timeout seconds.\n
+        This function is a coroutine
+        """
+        protocol, addr = await self._protocolFor(addr)
+        stat = "full" if isFullStat else "basic"
+        try:
+            with metrics.span("mcconnect_query_seconds",stat=stat) if metrics.instrumentation is not None else metrics.NO_SPAN:
+                return await asyncio.wait_for(self._stat(protocol,addr,isFullStat,sessionId,timeout),timeout)
+        except asyncio.TimeoutError:
+            if metrics.instrumentation is not None:
+                metrics.increment("mcconnect_query_timeouts_total",stat=stat)
+            raise ConnectionError("Could not connect to the server") from None
+        pass
+    pass
+
+class StatResult(Mapping):
+    """Base class of the results of stat requests.\n
+    The values are stored in slots and can be read as attributes (result.numplayers) or, like the dictionaries older versions returned, by key (result["numplayers"]).
+    Fields that the server did not send are None and are left out of the mapping.
+    """
+    __slots__ = ()
+    FIELDS : tuple[str, ...] = ()
+
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            setattr(self, field, values.get(field))
+            pass
+        pass
+
+    def __getitem__(self, key : str):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (field for field in self.FIELDS if getattr(self, field) is not None)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def asdict(self) -> dict:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{key}={value!r}' for key, value in self.items())})"
+    pass
+
+class BasicStat(StatResult):
+    """The result of QueryConnection.basicStat"""
+    FIELDS = ("MOTD","gametype","map","numplayers","maxplayers","hostport","hostip")
+    __slots__ = FIELDS
+    pass
+
+class FullStat(StatResult):
+    """The result of QueryConnection.fullStat\n
+    pluginhost and plugins are only set if the server reports plugins.
+    """
+    FIELDS = ("hostname","gametype","game_id","version","map","numplayers","maxplayers","hostport","hostip","pluginhost","plugins","players")
+    __slots__ = FIELDS
+    pass
+
+def _decode(view : memoryview) -> str:
+    return str(view,"utf-8","replace")
+
+def _nextString(data : bytes, view : memoryview, position : int) -> tuple[memoryview,int]:
+    """Returns the null terminated string starting at position and the position after its terminator."""
+    terminator = data.find(b"\x00",position)
+    if terminator == -1:
+        raise PacketError("Truncated query response")
+    return view[position:terminator], terminator+1
+
+def parseBasicStat(data : bytes) -> BasicStat:
+    """Parses the raw response to a basic stat request.\n
+    Raises a PacketError if the response is truncated or malformed.
+    """
+    if len(data) < 5 or data[0] != STAT_REQ_TYPE:
+        raise PacketError("Not a stat response")
+    view = memoryview(data)
+    position = 5
+    motd, position = _nextString(data,view,position)
+    gametype, position = _nextString(data,view,position)
+    map, position = _nextString(data,view,position)
+    numplayers, position = _nextString(data,view,position)
+    maxplayers, position = _nextString(data,view,position)
+    if position+2 > len(data):
+        raise PacketError("Truncated query response")
+    hostport = int.from_bytes(view[position:position+2],"little") # The only field that isn't sent as a string
+    hostip, position = _nextString(data,view,position+2)
+    try:
+        return BasicStat(
+            MOTD=_decode(motd), gametype=_decode(gametype), map=_decode(map),
+            numplayers=int(bytes(numplayers)), maxplayers=int(bytes(maxplayers)),
+            hostport=hostport, hostip=_decode(hostip)
+        )
+    except ValueError as exc:
+        raise PacketError(f"Malformed basic stat response: {exc}") from None
+    pass
+
+FULL_STAT_PADDING = b"splitnum\x00\x80\x00"
+PLAYER_SECTION    = b"\x01player_\x00\x00"
+
+def parseFullStat(data : bytes) -> FullStat:
+    """Parses the raw response to a full stat request.\n
+    Raises a PacketError if the response is truncated or malformed.
+    """
+    if len(data) < 5 or data[0] != STAT_REQ_TYPE:
+        raise PacketError("Not a stat response")
+    view = memoryview(data)
+    position = 5
+    if data.startswith(FULL_STAT_PADDING,position):
+        position += len(FULL_STAT_PADDING)
+
+    values : dict[str,memoryview] = {} # Key value pairs follow each other until an empty key
+    while True:
+        key, position = _nextString(data,view,position)
+        if len(key) == 0:
+            break
+        values[_decode(key)], position = _nextString(data,view,position)
+        pass
+
+    if not data.startswith(PLAYER_SECTION,position):
+        raise PacketError("Full stat response lacks the player section")
+    position += len(PLAYER_SECTION)
+    players = []
+    while position < len(data): # The list ends with an empty name; be lenient if that is missing
+        player, position = _nextString(data,view,position)
+        if len(player) == 0:
+            break
+        players.append(_decode(player))
+        pass
+
+    pluginhost = plugins = None
+    if len(values.get("plugins",b"")) > 0: # e.g. "CraftBukkit on Bukkit 1.16.5: WorldEdit 7.2; Essentials 2.18"
+        pluginhost, _, pluginList = _decode(values["plugins"]).partition(":")
+        plugins = [plugin.strip() for plugin in pluginList.split(";") if plugin.strip() != ""]
+        pluginhost = pluginhost.strip()
+        pass
+    try:
+        return FullStat(
+            hostname=_decode(values["hostname"]), gametype=_decode(values["gametype"]), game_id=_decode(values["game_id"]),
+            version=_decode(values["version"]), map=_decode(values["map"]),
+            numplayers=int(bytes(values["numplayers"])), maxplayers=int(bytes(values["maxplayers"])),
+            hostport=int(bytes(values["hostport"])), hostip=_decode(values["hostip"]),
+            pluginhost=pluginhost, plugins=plugins, players=players
+        )
+    except KeyError as exc:
+        raise PacketError(f"Full stat response lacks {exc}") from None
+    except ValueError as exc:
+        raise PacketError(f"Malformed full stat response: {exc}") from None
+    pass
+
 class QueryConnection:
     """Handles Query Connections to a Minecraft Server.\n
-    If you host a minecraft server, you will need to set enable-query = true in your server.properties.
+    If you host a minecraft server, you will need to set enable-query = true in your server.properties.\n
+    Connections that share a cache.TTLCache share their results: Requests for a server and stat type that was fetched recently are answered from the cache.
     """
-    def __init__(self,ip,port=25565, timeout : int = 30):
+    def __init__(self,ip,port=25565, timeout : int = 30, *, client : QueryClient = None, cache : TTLCache = None):
         self.ip = ip
         self.port = port
         self.sessionId = createSessionId()
 
         self.timeout = timeout
+        self.client = client
+        self.cache = cache
         pass
 
     def newSessionId(self):
@@ -97,119 +475,82 @@ class QueryConnection:
         return sessionId
         pass
 
-    # Deprecated, doesn't work with new __QueryProtocol__
-    # async def sendData(self, packet : bytes):
-    #     """Sends raw data to the server\n
-    #     Note: This should not be used manually
-    #     """
-    #     loop = asyncio.get_event_loop()
-    #     future : asyncio.Future = loop.create_future()
-    #     transport, protocol = await loop.create_datagram_endpoint(lambda: __QueryProtocol__(packet, future), remote_addr=(self.ip,self.port)) # Start the Protocol
-    #     done, pending = await asyncio.wait(future,timeout=30) # Wait for response; if none after 30 seconds, cancel
-    #     if len(pending > 0): future.cancel()
-
-    #     result : bytes = protocol.result
-    #     transport.close()
-    #     return result
+    async def sendData(self, isFullStat : bool) -> bytes:
+        """Runs a stat request and returns the raw response\n
+        Uses self.client if one was given, otherwise a temporary QueryClient that is closed afterwards.\n
+        Note: This should not be used manually
+        """
+        if self.client is not None:
+            return await self.client.query((self.ip,self.port),isFullStat,sessionId=self.sessionId,timeout=self.timeout)
+        async with QueryClient() as client:
+            return await client.query((self.ip,self.port),isFullStat,sessionId=self.sessionId,timeout=self.timeout)
+        pass
 
-    async def basicStat(self):
+    async def basicStat(self) -> BasicStat:
         """Retrieves the basic statistics of a server.\n
-        This includes: MOTD, gametype (creative, survival, etc.), map name, number of players online, maximum number of players, hostport, and hostip (this output can be questionable)
+        This includes: MOTD, gametype (creative, survival, etc.), map name, number of players online, maximum number of players, hostport, and hostip (this output can be questionable)\n
+        If the connection has a cache, a cached result may be returned.
         """
-        loop = asyncio.get_event_loop()
-        future : asyncio.Future = loop.create_future()
-        transport, protocol = await loop.create_datagram_endpoint(lambda: __QueryProtocol__(self.sessionId,False,future,(self.ip,self.port)), remote_addr=(self.ip,self.port))
-        done, pending = await asyncio.wait([future],timeout=self.timeout) # Wait for response; if none after 30 seconds, cancel
-        if len(pending) > 0: future.set_exception(ConnectionError("Could not connect to the server"))
-        result = protocol.result
-        future.result()
-        
-        logging.debug(f"Base Stat Response: {result}") 
-        
-        reqType = result[0]
-
-        data : bytes = result[5:]
-        retrievedData = {"MOTD":None,"gametype":None,"map":None,"numplayers":None,"maxplayers":None,"hostport":None,"hostip":None}
-        remainingData = data
-        for i in range(5):
-            terminator = remainingData.find(b"\x00")
-            retrievedData[list(retrievedData.keys())[i]] = remainingData[:terminator]
-            
-            remainingData = remainingData[terminator+1:]
-            pass
-
-        retrievedData["hostport"] = int.from_bytes(remainingData[:2],"little")
-        retrievedData["hostip"] = remainingData[2:-1]
+        if self.cache is not None:
+            return await self.cache.get((self.ip,self.port,"basic"),self._basicStat)
+        return await self._basicStat()
 
-        ### Interpretation
-        interpreted = {}
-        interpreted["MOTD"] = retrievedData["MOTD"].decode("utf-8")
-        interpreted["gametype"] = retrievedData["gametype"].decode("utf-8")
-        interpreted["map"] = retrievedData["map"].decode("utf-8")
-        interpreted["numplayers"] = int(retrievedData["numplayers"])
-        interpreted["maxplayers"] = int(retrievedData["maxplayers"])
-        interpreted["hostport"] = retrievedData["hostport"]
-        interpreted["hostip"] = retrievedData["hostip"].decode("utf-8")
+    async def _basicStat(self) -> BasicStat:
+        result = await self.sendData(False)
+        logging.debug(f"Base Stat Response: {result}")
+        with metrics.span("mcconnect_parse_seconds",stat="basic") if metrics.instrumentation is not None else metrics.NO_SPAN:
+            return parseBasicStat(result)
 
-        return interpreted
-        pass
-
-    async def fullStat(self):
+    async def fullStat(self) -> FullStat:
         """Retrieves the full statistic for a server.\n
-        This includes every basic stat plus the following: game_id (generally MINECRAFT), game version (e.g. 1.16.5), pluginhost (e.g. CraftBukkit on Bukkit 1.16.5-R0.1-SNAPSHOT), plugins (if available), and players
+        This includes every basic stat plus the following: game_id (generally MINECRAFT), game version (e.g. 1.16.5), pluginhost (e.g. CraftBukkit on Bukkit 1.16.5-R0.1-SNAPSHOT), plugins (if available), and players\n
+        If the connection has a cache, a cached result may be returned.
         """
-        loop = asyncio.get_event_loop()
-        future : asyncio.Future = loop.create_future()
-        transport, protocol = await loop.create_datagram_endpoint(lambda: __QueryProtocol__(self.sessionId,True,future), remote_addr=(self.ip,self.port))
-        done, pending = await asyncio.wait(future,timeout=self.timeout) # Wait for response; if none after 30 seconds, cancel
-        if len(pending > 0): future.cancel()
-        result = protocol.result
+        if self.cache is not None:
+            return await self.cache.get((self.ip,self.port,"full"),self._fullStat)
+        return await self._fullStat()
 
+    async def _fullStat(self) -> FullStat:
+        result = await self.sendData(True)
         logging.debug(f"Full Stat Response: {result}")
+        with metrics.span("mcconnect_parse_seconds",stat="full") if metrics.instrumentation is not None else metrics.NO_SPAN:
+            return parseFullStat(result)
+    pass
 
-        content : bytes = result[5:-1]
-        base, players = content.split(b"\x01\x70\x6C\x61\x79\x65\x72\x5F\x00\x00")
-        
-        baseData = {}
-        temp = base.split(b"\x00")
-        for i in range(0,len(temp),2):
-            if not temp[i] == b'':
-                baseData[temp[i].decode("utf-8")] = temp[i+1] # Key Value pairs are behind each other in response
-        del temp
-
-        interpretedBase = {}
-        interpretedBase["hostname"  ] = baseData["hostname"  ].decode("utf-8")
-        interpretedBase["gametype"  ] = baseData["gametype"  ].decode("utf-8")
-        interpretedBase["game_id"   ] = baseData["game_id"   ].decode("utf-8")
-        interpretedBase["version"   ] = baseData["version"   ].decode("utf-8")
-        interpretedBase["map"       ] = baseData["map"       ].decode("utf-8")
-        interpretedBase["numplayers"] = int(baseData["numplayers"])
-        interpretedBase["maxplayers"] = int(baseData["maxplayers"])
-        interpretedBase["hostport"  ] = int(baseData["hostport"  ])
-        interpretedBase["hostip"    ] = baseData["hostip"    ].decode("utf-8")
-        
-        if baseData["plugins"] != b"":
-            interpretedBase["pluginhost"] = baseData["plugins"].split(b":")[0]
-            interpretedBase["plugins"   ] = [plugins.decode("utf-8") for plugins in baseData["plugins"].split(b":")[1].split(b";")] if len(baseData["plugins"].split(b":")) > 1 else []
-            pass
-        
-        playerList = [player.decode("utf-8") for player in players.split(b"\x00") if player != b""]
-        
-        interpreted = {}
-        interpreted |= interpretedBase
-        interpreted    ["players"   ] = playerList
+async def scan(targets : Iterable[tuple[str,int]], *, fullStat : bool = False, concurrency : int = 256, timeout : float = 5, retries : int = 1, client : QueryClient = None) -> AsyncIterator[FleetResult]:
+    """Runs a basic stat (or a full stat if fullStat is True) against every (ip, port) in targets.\n
+    At most concurrency requests are in flight at once. A target that did not answer after timeout seconds is retried up to retries times.\n
+    Yields a fleet.FleetResult for every target as soon as it is done; target is the (ip, port) tuple and result the stat.\n
+    All requests share client. If none is given, a temporary QueryClient is used and closed when the scan ends.\n
+    Usage: async for result in scan(targets): ...
+    """
+    ownClient = client is None
+    if ownClient:
+        client = QueryClient()
 
-        return interpreted
-        pass
+    async def stat(target : tuple[str,int]):
+        connection = QueryConnection(target[0],target[1],timeout,client=client)
+        return await (connection.fullStat() if fullStat else connection.basicStat())
+
+    try:
+        async for result in runBounded(stat,targets,concurrency=concurrency,retries=retries):
+            yield result
+            pass
+    finally:
+        if ownClient:
+            client.close()
     pass
 
-async def main():
+async def main(argv : list[str]):
+    """Usage: python -m mcconnect.query [ip] [port]"""
     logging.basicConfig(level=logging.INFO)
-    IP = "127.0.0.1"
-    conn = QueryConnection("192.168.0.41")
+    ip = argv[0] if len(argv) > 0 else "127.0.0.1"
+    port = int(argv[1]) if len(argv) > 1 else 25565
+    conn = QueryConnection(ip,port)
     print("Basic stat:",await conn.basicStat())
     pass
 
 if __name__=="__main__":
-    asyncio.run(main())
+    import sys
+    asyncio.run(main(sys.argv[1:]))
     pass
\ No newline at end of file
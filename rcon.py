@@ -1,10 +1,14 @@
-import asyncio, random
+import asyncio, random, contextlib, logging, heapq, codecs, re, collections
+from typing import AsyncIterator, Iterable
 from mcconnect.errors import *
+from mcconnect import metrics
+from mcconnect.cache import TTLCache
 
 MAX_CS_LENGTH = 1446
 MAX_SC_LENGTH = 4096
+VANILLA_READ_LENGTH = 1460 # Vanilla servers read at most this much at once and expect exactly one packet per read
 
-BUFFER_SIZE = 8192
+READ_ONLY_COMMANDS = frozenset(("list","list uuids","tps","forge tps","seed","banlist","banlist ips","banlist players","whitelist list"))
 
 class RequestTypes:
     LOGIN   = 3
@@ -13,17 +17,12 @@ class RequestTypes:
 
     __INVALID__ = 200
 
-class PacketError(Exception):
-    """Something went wrong with the packet
-    """
-    pass
-
 def createRconPacket(reqId : int, type : int, payload : str,*,forcedLength : int = None):
-    if len(payload)+1 > MAX_CS_LENGTH: raise PacketError("Payload too large") # Includes the null terminator
+    bytePayload = payload.encode("utf-8") + b"\x00"
+    if len(bytePayload) > MAX_CS_LENGTH: raise PacketError("Payload too large") # Includes the null terminator
 
     byteReqId   = reqId.to_bytes(4,"little",signed=True)
     byteType    = type.to_bytes(4,"little",signed=True)
-    bytePayload = payload.encode("ascii") + b"\x00"
 
     lengthlessPacket = byteReqId + byteType + bytePayload + b"\x00"
     packet = int.to_bytes(len(lengthlessPacket) if forcedLength == None else forcedLength,4,"little",signed=True) + lengthlessPacket
@@ -42,95 +41,450 @@ def extractFromPacket(packet : bytes):
         bytePayload
     )
 
-def removeColours(payload : bytes):
-    discoloured = b""
-    for part in payload.split(b"\xa7"):
-        discoloured += part[1:]
+async def readPacket(reader : asyncio.StreamReader) -> tuple[int,int,memoryview]:
+    """Reads exactly one packet from reader and returns its request id, type and payload.\n
+    The length prefix tells how much to read, so nothing is ever read twice or copied; the payload is a view into the received packet.\n
+    Raises an asyncio.IncompleteReadError if the stream ends and a PacketError if the length is invalid.\n
+    This function is a coroutine
+    """
+    packetLength = int.from_bytes(await reader.readexactly(4),"little",signed=True)
+    if packetLength < 10: raise PacketError(f"Invalid packet length {packetLength}") # Request id, type and two null bytes
+    packet = memoryview(await reader.readexactly(packetLength))
+    return (
+        int.from_bytes(packet[0:4],"little",signed=True),
+        int.from_bytes(packet[4:8],"little",signed=True),
+        packet[8:-2]
+    )
+
+COLOUR_CODE       = re.compile("§.?",re.DOTALL) # § and the character after it, e.g. §a (green) or §l (bold)
+COLOUR_CODE_BYTES = re.compile(b"\xc2\xa7(?:[\x00-\x7f]|[\xc2-\xf4][\x80-\xbf]{1,3})?") # The same in UTF-8
+
+def removeColours(payload : bytes) -> bytes:
+    """Removes every colour and formatting code from the UTF-8 encoded payload in linear time"""
+    return COLOUR_CODE_BYTES.sub(b"",payload)
+
+def stripColours(text : str) -> str:
+    """Removes every colour and formatting code from a decoded response"""
+    return COLOUR_CODE.sub("",text)
+
+class ResponseDecoder:
+    """Decodes a response chunk by chunk (e.g. the fragments of Rconnection.stream) and removes colour codes on the way if stripColours is True.\n
+    Characters and colour codes split between two chunks are handled: the incomplete part is held back until the next chunk arrives.
+    Bytes that aren't valid UTF-8 are replaced with U+FFFD.\n
+    Usage:
+        decoder = ResponseDecoder()
+        text = decoder.decode(chunk) # For every chunk
+        text = decoder.decode(b"",final=True) # Once the response is complete
+    """
+    def __init__(self, *, stripColours : bool = True):
+        self.stripColours = stripColours
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._pending = "" # A § whose code is in the next chunk
         pass
-    return discoloured
+
+    def decode(self, chunk : bytes, final : bool = False) -> str:
+        text = self._pending + self._decoder.decode(chunk,final)
+        self._pending = ""
+        if not self.stripColours:
+            return text
+        if not final and (len(text) - len(text.rstrip("§"))) % 2 == 1: # The last § has no code yet; §§ is a code of its own
+            self._pending = "§"
+            text = text[:-1]
+        return COLOUR_CODE.sub("",text)
     pass
 
 def createReqId():
     return int.from_bytes(random.randbytes(3) + b"\x00","little",signed=True)
     pass
 
+class _Request:
+    """A command waiting for its response fragments.\n
+    The fragments are either collected and joined into future once the response is complete, or handed to queue one by one if the response is streamed.
+    A streamed request counts as full once limit fragments are queued; the reader then waits for drained.
+    """
+    __slots__ = ("sentinelId","fragments","future","queue","received","limit","drained")
+
+    def __init__(self, sentinelId : int, future : asyncio.Future = None, queue : asyncio.Queue = None, limit : int = None):
+        self.sentinelId = sentinelId
+        self.fragments : list[memoryview] = []
+        self.future = future
+        self.queue = queue
+        self.received = 0
+        self.limit = limit
+        self.drained : asyncio.Event = asyncio.Event() if limit is not None else None
+        pass
+
+    @property
+    def full(self) -> bool:
+        return self.limit is not None and self.queue.qsize() >= self.limit
+
+    def add(self, fragment : memoryview):
+        self.received += 1
+        if self.queue is not None:
+            self.queue.put_nowait(fragment)
+        else:
+            self.fragments.append(fragment)
+        pass
+
+    def finish(self):
+        if metrics.instrumentation is not None:
+            metrics.observe("mcconnect_rcon_fragments",self.received)
+        if self.queue is not None:
+            self.queue.put_nowait(None)
+        elif not self.future.done():
+            self.future.set_result(b"".join(self.fragments)) # The only copy of the response
+        pass
+
+    def fail(self, error : Exception):
+        if self.queue is not None:
+            self.queue.put_nowait(error)
+        elif not self.future.done():
+            self.future.set_exception(error)
+        pass
+    pass
+
 class Rconnection:
-    def __init__(self,ip : str,port : int,password : str):
+    """Handles an RCON connection to a Minecraft Server.\n
+    After Rconnection.start, a background task reads every packet the server sends and routes it to the request with the same request id.
+    That way many coroutines can use the same connection at once.\n
+    Each command is followed by a packet of an invalid type (the sentinel). The server answers it only after it sent the complete response to the command, so its answer marks the end of multi-packet responses.\n
+    A vanilla server reads at most VANILLA_READ_LENGTH bytes at once and closes the connection unless a read holds exactly one packet. So by default each packet is written only once the server answered the previous one, which costs a round trip per packet.
+    With pipeline=True, packets are written right away and many commands can be in flight at once; only use it with servers that split the stream into packets by their length prefix.\n
+    If a cache.TTLCache is given, the responses of read-only commands (those in cacheable) are cached under (ip, port, command): Concurrent calls of the same command share one request and later calls get the cached response until it expires.
+    Every other command always goes to the server.
+    """
+    def __init__(self,ip : str,port : int,password : str,*,cache : TTLCache = None,cacheable : Iterable[str] = READ_ONLY_COMMANDS,pipeline : bool = False):
         self.ip = ip
         self.port = port
         self.password = password
+        self.cache = cache
+        self.cacheable = frozenset(cacheable)
+        self.pipeline = pipeline
         
         self.connection : tuple[asyncio.StreamReader,asyncio.StreamWriter] = None
         self.reqId = createReqId()
+
+        self._readTask : asyncio.Task = None
+        self._requests : dict[int,_Request] = {} # Command request id -> waiting request
+        self._sentinels : dict[int,int] = {} # Sentinel request id -> command request id
+        self._login : tuple[int,asyncio.Future] = None
+
+        self._writeTask : asyncio.Task = None
+        self._outbox : collections.deque[tuple[int,bytes,asyncio.Future]] = collections.deque() # Packets waiting for the previous one to be answered
+        self._outboxReady = asyncio.Event()
+        self._answered : tuple[int,asyncio.Future] = None # Request id of the packet written last and the future set once it is answered
         pass
 
+    @property
+    def connected(self) -> bool:
+        return self.connection is not None and not self.connection[1].is_closing() and self._readTask is not None and not self._readTask.done()
+
+    def nextReqId(self) -> int:
+        """Returns a request id that isn't used by any request in flight"""
+        self.reqId = self.reqId % 0x7FFFFFFF + 1 # Stay positive; -1 is used by the server to signal failed authentication
+        return self.reqId
+
     async def connect(self):
         reader, writer = await asyncio.open_connection(self.ip,self.port)
         self.connection = (reader, writer)
+        self._readTask = asyncio.ensure_future(self._readLoop(reader))
+        if not self.pipeline:
+            self._writeTask = asyncio.ensure_future(self._writeLoop(writer))
         pass
 
-    async def sendData(self,type : int,payload : str,*, returnRaw : bool = False):
-        if self.connection == None or self.connection[0].at_eof() or self.connection[1].is_closing(): raise ConnectionError("No connection established or connection is closed")
-        packet : bytes = createRconPacket(self.reqId,type,payload)
-        
-        reader, writer = self.connection
-        await writer.drain()
-        writer.write(packet)
-
-        if type == RequestTypes.COMMAND:
-            contraPacket = createRconPacket(self.reqId,RequestTypes.__INVALID__,"")
-            writer.write(contraPacket)
-            expectedEndPackage = createRconPacket(self.reqId,RequestTypes.RESPONSE,f"Unknown request {hex(RequestTypes.__INVALID__)[2:]}")
-
-            finished = False
-            buffer = b""
-            while not finished:
-                buffer += await reader.read(BUFFER_SIZE)
-                finished = buffer.endswith(expectedEndPackage)
-                pass
-            rawPackets : bytes = buffer.removesuffix(expectedEndPackage)
-            
-            packets : list[bytes] = []
-            packetBeginPos = 0
-            while packetBeginPos < len(rawPackets):
-                thisPacketLen : int = int.from_bytes(rawPackets[packetBeginPos:packetBeginPos+4],"little",signed=True) + 4
-                packets.append(rawPackets[packetBeginPos:packetBeginPos+thisPacketLen])
-                packetBeginPos+=thisPacketLen
+    async def close(self):
+        """Closes the connection. Requests still waiting for a response fail with a ConnectionError.\n
+        This function is a coroutine
+        """
+        if self._readTask is not None:
+            self._readTask.cancel()
+        if self._writeTask is not None:
+            self._writeTask.cancel()
+        if self.connection is not None:
+            writer = self.connection[1]
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
                 pass
+        pass
 
-            data = b""
-            for packet in packets:
-                packetLength, packetReqId, packetType, packetPayload = extractFromPacket(packet)
-                data+=packetPayload
+    async def _readLoop(self, reader : asyncio.StreamReader):
+        error = ConnectionError("Connection was closed")
+        try:
+            while True:
+                reqId, type, payload = await readPacket(reader)
+                if metrics.instrumentation is not None:
+                    metrics.increment("mcconnect_bytes_received_total",len(payload)+14,protocol="rcon") # Length, request id, type and null bytes
+                request = self._dispatch(reqId,type,payload)
+                if request is not None and request.full: # Stop reading until the consumer catches up; this holds up every other request too
+                    request.drained.clear()
+                    await request.drained.wait()
                 pass
-            return data.decode("ascii")
+        except asyncio.IncompleteReadError:
+            error = ConnectionError("Connection was closed by the server")
+        except PacketError as exc:
+            error = exc
+        except OSError as exc:
+            error = ConnectionError(f"Connection failed: {exc}")
+        finally:
+            if self._writeTask is not None:
+                self._writeTask.cancel()
+            self._failAll(error)
+            if self.connection is not None:
+                self.connection[1].close()
+        pass
+
+    async def _writeLoop(self, writer : asyncio.StreamWriter):
+        """Writes the packets in self._outbox one by one, each only after the previous one was answered"""
+        loop = asyncio.get_running_loop()
+        while True:
+            if len(self._outbox) == 0:
+                self._outboxReady.clear()
+                await self._outboxReady.wait()
+                continue
+            reqId, packet, written = self._outbox.popleft()
+            if packet is not None:
+                answered = loop.create_future()
+                self._answered = (reqId, answered)
+                writer.write(packet)
+                if metrics.instrumentation is not None:
+                    metrics.increment("mcconnect_bytes_sent_total",len(packet),protocol="rcon")
+                await writer.drain()
+                await answered
+            if written is not None and not written.done(): # Marker of Rconnection._flush
+                written.set_result(None)
+            pass
+        pass
+
+    def _write(self, packets : list[tuple[int,bytes]]) -> None:
+        """Writes packets, given as (request id, packet) pairs: right away with pipelining, otherwise through _writeLoop"""
+        if self.pipeline:
+            data = b"".join(packet for _, packet in packets)
+            self.connection[1].write(data)
+            if metrics.instrumentation is not None:
+                metrics.increment("mcconnect_bytes_sent_total",len(data),protocol="rcon")
+        else:
+            self._outbox.extend((reqId, packet, None) for reqId, packet in packets)
+            self._outboxReady.set()
+        pass
+
+    async def _flush(self) -> None:
+        """Waits until everything passed to _write was written (and, without pipelining, answered)"""
+        if not self.pipeline:
+            written = asyncio.get_running_loop().create_future()
+            self._outbox.append((None, None, written))
+            self._outboxReady.set()
+            await written
+        await self.connection[1].drain()
+        pass
+
+    def _dispatch(self, reqId : int, type : int, payload : memoryview):
+        if self._answered is not None and (reqId == self._answered[0] or reqId == -1): # The server read the last packet; the next one may follow
+            if not self._answered[1].done():
+                self._answered[1].set_result(None)
+            self._answered = None
+        if self._login is not None and (reqId == -1 or reqId == self._login[0]) and type == RequestTypes.COMMAND: # Auth responses share their type with commands
+            future = self._login[1]
+            self._login = None
+            if not future.done():
+                future.set_result((reqId, type, bytes(payload)))
+            return
+        commandId = self._sentinels.pop(reqId,None)
+        if commandId is not None: # Everything belonging to the command was received
+            request = self._requests.pop(commandId,None)
+            if request is not None:
+                request.finish()
+            return
+        request = self._requests.get(reqId)
+        if request is not None:
+            request.add(payload)
+        return request
+
+    def _failAll(self, error : Exception):
+        requests = list(self._requests.values())
+        self._requests.clear()
+        self._sentinels.clear()
+        for request in requests:
+            request.fail(error)
             pass
+        while len(self._outbox) > 0:
+            written = self._outbox.popleft()[2]
+            if written is not None and not written.done():
+                written.set_exception(error)
+            pass
+        if self._login is not None:
+            if not self._login[1].done():
+                self._login[1].set_exception(error)
+            self._login = None
+        pass
+
+    def _registerCommand(self, cmd : str, request : _Request) -> tuple[int,list[tuple[int,bytes]]]:
+        """Registers request to receive the response to cmd. Returns the request id and the packets (command and sentinel) to write as (request id, packet) pairs."""
+        reqId = self.nextReqId()
+        packet = createRconPacket(reqId,RequestTypes.COMMAND,cmd)
+        request.sentinelId = self.nextReqId()
+        self._requests[reqId] = request
+        self._sentinels[request.sentinelId] = reqId
+        return reqId, [(reqId, packet), (request.sentinelId, createRconPacket(request.sentinelId,RequestTypes.__INVALID__,""))]
+
+    def _sendCommand(self, cmd : str, request : _Request) -> int:
+        """Writes cmd and its sentinel and registers request to receive the response. Returns the request id."""
+        if not self.connected: raise ConnectionError("No connection established or connection is closed")
+        reqId, packets = self._registerCommand(cmd,request)
+        self._write(packets)
+        return reqId
+
+    def _forget(self, reqId : int):
+        request = self._requests.pop(reqId,None)
+        if request is not None:
+            self._sentinels.pop(request.sentinelId,None)
+            if request.drained is not None: # Don't leave the reader waiting for a consumer that is gone
+                request.drained.set()
+        pass
+
+    async def sendData(self,type : int,payload : str,*, returnRaw : bool = False):
+        if not self.connected: raise ConnectionError("No connection established or connection is closed")
+        future = asyncio.get_running_loop().create_future()
+
+        if type == RequestTypes.COMMAND:
+            with metrics.span("mcconnect_rcon_command_seconds") if metrics.instrumentation is not None else metrics.NO_SPAN:
+                reqId = self._sendCommand(payload,_Request(None,future))
+                try:
+                    await self.connection[1].drain()
+                    data : bytes = await future
+                finally: # Forget the request if the caller gave up
+                    self._forget(reqId)
+            return data.decode("utf-8","replace")
         elif type == RequestTypes.LOGIN:
-            data : bytes = await reader.read(BUFFER_SIZE)
-        
-            if not returnRaw:
-                dataLength = int.from_bytes(data[:4],"little",signed=True)
-                if dataLength + 4 != len(data): raise PacketError
+            if self._login is not None: raise CommandError("Another login is in progress")
+            reqId = self.nextReqId()
+            self._login = (reqId, future)
+            self._write([(reqId, createRconPacket(reqId,type,payload))])
+            await self.connection[1].drain()
+            dataId, dataType, data = await future
 
-                dataId = int.from_bytes(data[4:8],"little",signed=True)
-                if dataId == -1: raise AuthError("Authentication failed")
-                elif dataId != self.reqId: raise CommandError("Response did not match the request")
+            if returnRaw: # Rebuild the packet as it was received
+                body = dataId.to_bytes(4,"little",signed=True) + dataType.to_bytes(4,"little",signed=True) + data + b"\x00\x00"
+                return len(body).to_bytes(4,"little",signed=True) + body
+            if dataId == -1: raise AuthError("Authentication failed")
+            elif dataId != reqId: raise CommandError("Response did not match the request")
+            return data
+        pass
 
-                if returnRaw:
-                    return data
-                dataType = data[8:12]
-                dataPayload = data[12:-2]
+    async def commands(self, cmds : Iterable[str], *, discardResponses : bool = False, maxBatchLength : int = MAX_CS_LENGTH) -> list[str]:
+        """Sends many commands at once and returns their responses in the same order.\n
+        With pipelining, the packets of the commands are packed into as few writes as possible, each at most maxBatchLength bytes (a single command and its sentinel always fit).
+        Without it (the default, see Rconnection), the packets are still written one at a time, but without waiting for the caller between commands.\n
+        If discardResponses is True, no sentinels are sent, the responses are ignored and None is returned once everything has been written.\n
+        This function is a coroutine
+        """
+        if not self.connected: raise ConnectionError("No connection established or connection is closed")
+        reqIds : list[int] = []
+        futures : list[asyncio.Future] = []
+        batch : list[tuple[int,bytes]] = []
+        batchLength = 0
+        try:
+            for cmd in cmds:
+                if discardResponses:
+                    reqId = self.nextReqId()
+                    packets = [(reqId, createRconPacket(reqId,RequestTypes.COMMAND,cmd))]
+                else:
+                    future = asyncio.get_running_loop().create_future()
+                    reqId, packets = self._registerCommand(cmd,_Request(None,future))
+                    reqIds.append(reqId)
+                    futures.append(future)
+                length = sum(len(packet) for _, packet in packets)
+                if len(batch) > 0 and batchLength + length > maxBatchLength:
+                    self._write(batch)
+                    await self.connection[1].drain()
+                    batch = []
+                    batchLength = 0
+                batch += packets
+                batchLength += length
+                pass
+            if len(batch) > 0:
+                self._write(batch)
+            await self._flush()
+            if discardResponses:
+                return None
+            return [data.decode("utf-8","replace") for data in await asyncio.gather(*futures)]
+        finally: # Forget the requests if the caller gave up or one of them failed
+            for reqId in reqIds:
+                self._forget(reqId)
+                pass
+        pass
 
-                return dataPayload
-            else:
-                return data
+    async def stream(self, cmd : str, *, maxBuffered : int = 64) -> AsyncIterator[bytes]:
+        """Sends a command and yields the fragments (one per packet, up to MAX_SC_LENGTH bytes) of its response as they arrive.\n
+        Use this for huge outputs that shouldn't be buffered completely: At most maxBuffered fragments are held for a slow consumer (None for no limit).
+        Once that many are waiting, the connection stops reading until the consumer catches up, which also holds up every other request on this connection.\n
+        Usage: async for fragment in rcon.stream("list"): ...
+        """
+        queue = asyncio.Queue()
+        request = _Request(None,queue=queue,limit=maxBuffered)
+        reqId = self._sendCommand(cmd,request)
+        try:
+            await self.connection[1].drain()
+            while True:
+                fragment = await queue.get()
+                if request.drained is not None and not request.full:
+                    request.drained.set()
+                if fragment is None:
+                    break
+                if isinstance(fragment,Exception):
+                    raise fragment
+                yield bytes(fragment)
+                pass
+        finally: # Fragments arriving after the caller gave up are dropped
+            self._forget(reqId)
+        pass
+
+    async def streamText(self, cmd : str, *, stripColours : bool = True, maxBuffered : int = 64) -> AsyncIterator[str]:
+        """Like Rconnection.stream, but yields the response as decoded text, without colour codes if stripColours is True.\n
+        Usage: async for text in rcon.streamText("list"): ...
+        """
+        decoder = ResponseDecoder(stripColours=stripColours)
+        async for fragment in self.stream(cmd,maxBuffered=maxBuffered):
+            text = decoder.decode(fragment)
+            if len(text) > 0:
+                yield text
             pass
+        text = decoder.decode(b"",final=True)
+        if len(text) > 0:
+            yield text
         pass
 
-    async def command(self,cmd : str):
+    async def command(self,cmd : str,*,cached : bool = None):
+        """Runs a command and returns its response.\n
+        With a cache, the response of a command in self.cacheable may be shared with concurrent or earlier calls. cached=True treats cmd as read-only regardless, cached=False always sends it.\n
+        This function is a coroutine
+        """
+        if cached is None:
+            cached = cmd in self.cacheable
+        if cached and self.cache is not None:
+            return await self.cache.get((self.ip,self.port,cmd),lambda: self.sendData(RequestTypes.COMMAND,cmd))
         return await self.sendData(RequestTypes.COMMAND,cmd)
         pass
 
+    async def ping(self) -> None:
+        """Checks that the server still answers by sending only a sentinel packet. No command is executed.\n
+        Raises a ConnectionError if the connection is closed.\n
+        This function is a coroutine
+        """
+        if not self.connected: raise ConnectionError("No connection established or connection is closed")
+        future = asyncio.get_running_loop().create_future()
+        reqId = self.nextReqId()
+        self._requests[reqId] = _Request(reqId,future)
+        self._sentinels[reqId] = reqId # The answer to the sentinel is all there is
+        self._write([(reqId, createRconPacket(reqId,RequestTypes.__INVALID__,""))])
+        try:
+            await self.connection[1].drain()
+            await future
+        finally:
+            self._forget(reqId)
+        pass
+
     async def login(self):
         data : bytes = await self.sendData(RequestTypes.LOGIN,self.password)
         pass
@@ -141,13 +495,389 @@ class Rconnection:
         pass
     pass
 
-async def __main__():
-    rcon = Rconnection("127.0.0.1",25575,"test")
+class RconPool:
+    """A pool of authenticated Rconnections to one server that can be shared by many users.\n
+    At most maxSize connections are open at once; the RCON thread of a Minecraft server is single-threaded, so there's no point in opening many.\n
+    Connections that died are replaced on the next Rconnection.acquire: A new connection is opened and logged in, retrying with exponential backoff (starting at backoff seconds, at most maxBackoff) up to retries times.
+    Idle connections are checked every healthInterval seconds with Rconnection.ping (or healthCommand, if given) and closed if they don't answer within healthTimeout seconds.\n
+    pipeline is passed on to the connections (see Rconnection).\n
+    With a cache.TTLCache, RconPool.command caches read-only commands like Rconnection.command does, before a connection is even acquired.\n
+    Usage:
+        async with pool.connection() as rcon:
+            await rcon.command("list")
+    or simply await pool.command("list")
+    """
+    def __init__(self, ip : str, port : int, password : str, *, maxSize : int = 2, retries : int = 5, backoff : float = 0.5, maxBackoff : float = 30, connectTimeout : float = 10, healthInterval : float = 30, healthTimeout : float = 5, healthCommand : str = None, cache : TTLCache = None, cacheable : Iterable[str] = READ_ONLY_COMMANDS, pipeline : bool = False):
+        if maxSize < 1: raise ValueError("maxSize must be at least 1")
+        self.ip = ip
+        self.port = port
+        self.password = password
+        self.cache = cache
+        self.cacheable = frozenset(cacheable)
+        self.pipeline = pipeline
+
+        self.maxSize = maxSize
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.connectTimeout = connectTimeout
+        self.healthInterval = healthInterval
+        self.healthTimeout = healthTimeout
+        self.healthCommand = healthCommand
+
+        self._idle : list[Rconnection] = []
+        self._semaphore : asyncio.Semaphore = None
+        self._healthTask : asyncio.Task = None
+        self.closed = False
+        pass
+
+    async def _open(self) -> Rconnection:
+        delay = self.backoff
+        attempt = 0
+        while True:
+            connection = Rconnection(self.ip,self.port,self.password,pipeline=self.pipeline)
+            try:
+                await asyncio.wait_for(connection.start(),self.connectTimeout)
+                return connection
+            except AuthError: # Retrying won't fix a wrong password
+                await connection.close()
+                raise
+            except (ConnectionError, OSError, asyncio.TimeoutError) as exc:
+                await connection.close()
+                attempt += 1
+                if attempt > self.retries:
+                    raise ConnectionError(f"Could not connect to {self.ip}:{self.port} after {attempt} attempts") from exc
+                logging.debug(f"Connecting to {self.ip}:{self.port} failed ({exc!r}), retrying in {delay} seconds")
+                await asyncio.sleep(delay)
+                delay = min(delay*2,self.maxBackoff)
+            pass
+        pass
+
+    async def acquire(self) -> Rconnection:
+        """Hands out a connection for exclusive use. It must be given back with RconPool.release.\n
+        Waits if maxSize connections are in use already.\n
+        This function is a coroutine
+        """
+        if self.closed: raise ConnectionError("The pool is closed")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.maxSize)
+        if self._healthTask is None and self.healthInterval:
+            self._healthTask = asyncio.ensure_future(self._healthLoop())
+
+        await self._semaphore.acquire()
+        try:
+            while len(self._idle) > 0:
+                connection = self._idle.pop()
+                if connection.connected:
+                    return connection
+                await connection.close()
+                pass
+            return await self._open()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        pass
+
+    def release(self, connection : Rconnection) -> None:
+        """Gives a connection handed out by RconPool.acquire back to the pool"""
+        if self.closed or not connection.connected:
+            asyncio.ensure_future(connection.close())
+        else:
+            self._idle.append(connection)
+        self._semaphore.release()
+        pass
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> AsyncIterator[Rconnection]:
+        """Acquires a connection for the duration of an async with block"""
+        connection = await self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+        pass
+
+    async def command(self, cmd : str, *, cached : bool = None) -> str:
+        """Runs a command on one of the pooled connections.\n
+        The command is not repeated if the connection breaks while it runs, as it might have been executed already.\n
+        Read-only commands are cached if the pool has a cache; cached works like for Rconnection.command.\n
+        This function is a coroutine
+        """
+        if cached is None:
+            cached = cmd in self.cacheable
+        if cached and self.cache is not None:
+            return await self.cache.get((self.ip,self.port,cmd),lambda: self._command(cmd))
+        return await self._command(cmd)
+
+    async def _command(self, cmd : str) -> str:
+        async with self.connection() as connection:
+            return await connection.command(cmd,cached=False)
+        pass
+
+    async def _check(self, connection : Rconnection) -> bool:
+        try:
+            if self.healthCommand is None:
+                await asyncio.wait_for(connection.ping(),self.healthTimeout)
+            else:
+                await asyncio.wait_for(connection.command(self.healthCommand),self.healthTimeout)
+            return True
+        except (ConnectionError, PacketError, OSError, asyncio.TimeoutError) as exc:
+            logging.info(f"Evicting RCON connection to {self.ip}:{self.port}: {exc!r}")
+            return False
+        pass
+
+    async def _healthLoop(self):
+        while not self.closed:
+            await asyncio.sleep(self.healthInterval)
+            for _ in range(len(self._idle)):
+                async with self._semaphore: # Count the connection being checked as in use
+                    if len(self._idle) == 0:
+                        break
+                    connection = self._idle.pop(0) # Oldest idle connection first
+                    if await self._check(connection) and not self.closed:
+                        self._idle.append(connection)
+                    else:
+                        await connection.close()
+                pass
+            pass
+        pass
+
+    async def close(self) -> None:
+        """Closes every idle connection and stops the health checks. Connections in use are closed when they are released.\n
+        This function is a coroutine
+        """
+        self.closed = True
+        if self._healthTask is not None:
+            self._healthTask.cancel()
+        idle = self._idle
+        self._idle = []
+        for connection in idle:
+            await connection.close()
+            pass
+        pass
+    pass
+
+class Priorities:
+    URGENT = 0  # e.g. kick, ban, stop
+    NORMAL = 10
+    BULK   = 20 # e.g. mass give or scoreboard updates
+
+class TokenBucket:
+    """Allows rate commands per second on average and bursts of up to burst commands.\n
+    Share one bucket between every scheduler that talks to the same server.
+    """
+    def __init__(self, rate : float, burst : float = None):
+        if rate <= 0: raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate,1)
+        self.tokens = self.burst
+        self._updated : float = None
+        pass
+
+    def _refill(self, now : float) -> None:
+        if self._updated is not None:
+            self.tokens = min(self.burst,self.tokens + (now - self._updated)*self.rate)
+        self._updated = now
+        pass
+
+    async def acquire(self) -> None:
+        """Waits until a token is available and takes it.\n
+        This function is a coroutine
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            self._refill(loop.time())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            pass
+        pass
+    pass
+
+class _Scheduled:
+    __slots__ = ("cmd","priority","future","queuedAt","timer","queued")
+
+    def __init__(self, cmd : str, priority : int, future : asyncio.Future, queuedAt : float):
+        self.cmd = cmd
+        self.priority = priority
+        self.future = future
+        self.queuedAt = queuedAt
+        self.timer : asyncio.TimerHandle = None
+        self.queued = True # Counted in the queue depth
+        pass
+    pass
+
+class RconScheduler:
+    """Sends the commands of many users over target (an Rconnection or RconPool) in order of priority, at a rate the server can take.\n
+    Commands wait in a priority queue (lower numbers first, see Priorities; same priority in submission order) and leave it only as fast as bucket allows.
+    At most maxInFlight commands are sent but unanswered at once, so an urgent command never queues behind a pile of bulk commands on the server.\n
+    Usage:
+        scheduler = RconScheduler(rcon, bucket=TokenBucket(20))
+        await scheduler.command("kick Steve", priority=Priorities.URGENT)
+    """
+    def __init__(self, target, *, bucket : TokenBucket = None, maxInFlight : int = 4):
+        if maxInFlight < 1: raise ValueError("maxInFlight must be at least 1")
+        self.target = target
+        self.bucket = bucket if bucket is not None else TokenBucket(20)
+        self.maxInFlight = maxInFlight
+
+        self._queue : list[tuple[int,int,_Scheduled]] = [] # Heap of (priority, sequence number, command)
+        self._sequence = 0
+        self._depths : dict[int,int] = {} # Priority -> commands waiting
+        self._wakeUp : asyncio.Event = None
+        self._inFlight : asyncio.Semaphore = None
+        self._dispatchTask : asyncio.Task = None
+        self._sending : set[asyncio.Task] = set()
+        self._label = f"{target.ip}:{target.port}"
+        self.closed = False
+        pass
+
+    @property
+    def depth(self) -> int:
+        """Number of commands waiting to be sent"""
+        return sum(self._depths.values())
+
+    @property
+    def depths(self) -> dict[int,int]:
+        """Number of commands waiting per priority"""
+        return {priority:depth for priority, depth in self._depths.items() if depth > 0}
+
+    def _count(self, priority : int, change : int) -> None:
+        self._depths[priority] = self._depths.get(priority,0) + change
+        if metrics.instrumentation is not None:
+            metrics.gauge("mcconnect_rcon_queue_depth",self._depths[priority],server=self._label,priority=str(priority))
+        pass
+
+    def _dequeue(self, scheduled : _Scheduled) -> None:
+        if scheduled.queued:
+            scheduled.queued = False
+            self._count(scheduled.priority,-1)
+        pass
+
+    def _drop(self, scheduled : _Scheduled) -> None:
+        if not scheduled.queued: # Sent already (or given up on); its answer is still wanted
+            return
+        self._dequeue(scheduled) # It stays in the heap until it is discarded, but doesn't count as waiting anymore
+        if not scheduled.future.done():
+            scheduled.future.set_exception(CommandError(f"{scheduled.cmd!r} was dropped, it could not be sent before its deadline"))
+            if metrics.instrumentation is not None:
+                metrics.increment("mcconnect_rcon_dropped_total",server=self._label,priority=str(scheduled.priority))
+        pass
+
+    async def command(self, cmd : str, *, priority : int = Priorities.NORMAL, deadline : float = None) -> str:
+        """Queues cmd and returns its response once it was sent and answered.\n
+        If deadline is given and cmd is still queued after deadline seconds, it is dropped and a CommandError is raised. Commands that were sent already are never dropped.\n
+        This function is a coroutine
+        """
+        if self.closed: raise ConnectionError("The scheduler is closed")
+        loop = asyncio.get_running_loop()
+        if self._dispatchTask is None:
+            self._wakeUp = asyncio.Event()
+            self._inFlight = asyncio.Semaphore(self.maxInFlight)
+            self._dispatchTask = asyncio.ensure_future(self._dispatch())
+        scheduled = _Scheduled(cmd,priority,loop.create_future(),loop.time())
+        if deadline is not None:
+            scheduled.timer = loop.call_later(deadline,self._drop,scheduled)
+        heapq.heappush(self._queue,(priority,self._sequence,scheduled))
+        self._sequence += 1
+        self._count(priority,1)
+        self._wakeUp.set()
+        try:
+            return await scheduled.future
+        finally:
+            self._dequeue(scheduled) # In case the caller gave up
+            if scheduled.timer is not None:
+                scheduled.timer.cancel()
+        pass
+
+    def _next(self) -> _Scheduled:
+        """Pops the most urgent command that is still wanted, if any"""
+        while len(self._queue) > 0:
+            _, _, scheduled = heapq.heappop(self._queue)
+            if scheduled.queued: # Not dropped or given up on by the caller
+                self._dequeue(scheduled)
+                if scheduled.timer is not None:
+                    scheduled.timer.cancel()
+                return scheduled
+            pass
+        return None
+
+    def _discardDropped(self) -> None:
+        """Removes commands that were dropped or given up on from the top of the heap"""
+        while len(self._queue) > 0 and not self._queue[0][2].queued:
+            heapq.heappop(self._queue)
+            pass
+        pass
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._discardDropped()
+            if len(self._queue) == 0:
+                self._wakeUp.clear()
+                await self._wakeUp.wait()
+                continue
+            await self._inFlight.acquire()
+            self._discardDropped() # Don't spend a token on commands that were dropped meanwhile
+            if len(self._queue) == 0:
+                self._inFlight.release()
+                continue
+            await self.bucket.acquire() # Pick the command only now, so one that was queued meanwhile with a higher priority goes first
+            scheduled = self._next()
+            if scheduled is None:
+                self._inFlight.release()
+                continue
+            if metrics.instrumentation is not None:
+                metrics.observe("mcconnect_rcon_queue_seconds",loop.time() - scheduled.queuedAt,server=self._label,priority=str(scheduled.priority))
+            task = asyncio.ensure_future(self._send(scheduled))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+            pass
+        pass
+
+    async def _send(self, scheduled : _Scheduled):
+        try:
+            response = await self.target.command(scheduled.cmd)
+            if not scheduled.future.done():
+                scheduled.future.set_result(response)
+        except Exception as exc:
+            if not scheduled.future.done():
+                scheduled.future.set_exception(exc)
+        finally:
+            self._inFlight.release()
+        pass
+
+    async def close(self) -> None:
+        """Stops sending. Queued commands fail with a ConnectionError; commands that were sent already are still answered.\n
+        This function is a coroutine
+        """
+        self.closed = True
+        if self._dispatchTask is not None:
+            self._dispatchTask.cancel()
+        error = ConnectionError("The scheduler was closed")
+        while len(self._queue) > 0:
+            _, _, scheduled = heapq.heappop(self._queue)
+            self._dequeue(scheduled)
+            if not scheduled.future.done():
+                scheduled.future.set_exception(error)
+            pass
+        await asyncio.gather(*self._sending,return_exceptions=True)
+        pass
+    pass
+
+async def __main__(argv : list[str]):
+    """Usage: python -m mcconnect.rcon [ip] [port] [password]"""
+    ip = argv[0] if len(argv) > 0 else "127.0.0.1"
+    port = int(argv[1]) if len(argv) > 1 else 25575
+    password = argv[2] if len(argv) > 2 else "test"
+    rcon = Rconnection(ip,port,password)
     await rcon.start()
     while True:
         print(await rcon.command(input("Please enter a command: ")))
     pass
 
 if __name__=="__main__":
-    asyncio.run(__main__())
+    import sys
+    asyncio.run(__main__(sys.argv[1:]))
     pass
\ No newline at end of file
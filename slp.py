@@ -0,0 +1,177 @@
+"""This library implements the Server List Ping, the protocol every Minecraft client uses to show servers in its server list.\n
+Unlike the query protocol, it needs no setting on the server and gets the status in a single exchange over TCP.
+For information on how this protocol works, visit https://wiki.vg/Server_List_Ping (not my page)
+"""
+
+import asyncio, json, logging, struct
+from typing import AsyncIterator, Iterable
+from mcconnect.errors import *
+from mcconnect import metrics
+from mcconnect.fleet import FleetResult, runBounded
+from mcconnect.query import StatResult
+
+PROTOCOL_VERSION = -1 # Servers answer status requests of any version; -1 means "just looking"
+STATUS_STATE     = 1
+
+HANDSHAKE_ID = 0x00
+STATUS_ID    = 0x00
+PING_ID      = 0x01
+
+MAX_RESPONSE_LENGTH = 1 << 21 # The protocol limits strings to 32767 characters; favicons make up most of it
+
+def encodeVarInt(value : int) -> bytes:
+    value &= 0xFFFFFFFF # Negative numbers are sent as their two's complement
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value != 0:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+        pass
+    pass
+
+def decodeVarInt(data : bytes, position : int = 0) -> tuple[int,int]:
+    """Decodes the VarInt at position in data and returns it and the position after it"""
+    value = 0
+    for i in range(5):
+        if position+i >= len(data): raise PacketError("Truncated VarInt")
+        byte = data[position+i]
+        value |= (byte & 0x7F) << (7*i)
+        if not byte & 0x80:
+            return (value - (1 << 32) if value & 0x80000000 else value), position+i+1
+        pass
+    raise PacketError("VarInt is too long")
+
+async def readVarInt(reader : asyncio.StreamReader) -> int:
+    value = 0
+    for i in range(5):
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << (7*i)
+        if not byte & 0x80:
+            return value - (1 << 32) if value & 0x80000000 else value
+        pass
+    raise PacketError("VarInt is too long")
+
+def encodeString(value : str) -> bytes:
+    encoded = value.encode("utf-8")
+    return encodeVarInt(len(encoded)) + encoded
+
+def createSlpPacket(packetId : int, payload : bytes) -> bytes:
+    body = encodeVarInt(packetId) + payload
+    return encodeVarInt(len(body)) + body
+
+async def readSlpPacket(reader : asyncio.StreamReader) -> tuple[int,bytes]:
+    """Reads one packet and returns its id and payload.\n
+    This function is a coroutine
+    """
+    length = await readVarInt(reader)
+    if length < 1 or length > MAX_RESPONSE_LENGTH: raise PacketError(f"Invalid packet length {length}")
+    body = await reader.readexactly(length)
+    packetId, position = decodeVarInt(body)
+    return packetId, body[position:]
+
+def _flattenText(component) -> str:
+    """Turns a chat component (or plain string) into its plain text"""
+    if isinstance(component,str):
+        return component
+    if isinstance(component,list):
+        return "".join(_flattenText(part) for part in component)
+    if isinstance(component,dict):
+        return _flattenText(component.get("text","")) + "".join(_flattenText(part) for part in component.get("extra",[]))
+    return ""
+
+class ServerStatus(StatResult):
+    """The result of StatusConnection.status\n
+    Uses the same keys as the query results where they overlap. players is only a sample of the players online (the server decides how many).
+    latency is the ping/pong round trip time in seconds, if the server answered the ping.
+    """
+    FIELDS = ("MOTD","version","protocol","numplayers","maxplayers","players","favicon","latency")
+    __slots__ = FIELDS
+    pass
+
+def parseStatus(payload : bytes) -> ServerStatus:
+    """Parses the payload of a status response.\n
+    Raises a PacketError if it is malformed.
+    """
+    length, position = decodeVarInt(payload) # The JSON is sent as a string, prefixed by its length
+    if position + length > len(payload): raise PacketError("Truncated status response")
+    try:
+        document = json.loads(payload[position:position+length].decode("utf-8"))
+        version = document.get("version",{})
+        players = document.get("players",{})
+        return ServerStatus(
+            MOTD=_flattenText(document.get("description","")),
+            version=version.get("name"), protocol=version.get("protocol"),
+            numplayers=int(players.get("online",0)), maxplayers=int(players.get("max",0)),
+            players=[player.get("name","") for player in players.get("sample",[])],
+            favicon=document.get("favicon")
+        )
+    except (ValueError, TypeError, AttributeError) as exc:
+        raise PacketError(f"Malformed status response: {exc}") from None
+    pass
+
+class StatusConnection:
+    """Gets the status of a Minecraft Server via the Server List Ping.\n
+    ip can also be a host name. The port is the normal game port of the server.\n
+    Raises a ConnectionError if the server did not answer within timeout seconds.
+    """
+    def __init__(self, ip : str, port : int = 25565, timeout : float = 5, *, measureLatency : bool = True):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.measureLatency = measureLatency
+        pass
+
+    async def _status(self) -> ServerStatus:
+        reader, writer = await asyncio.open_connection(self.ip,self.port)
+        try:
+            handshake = encodeVarInt(PROTOCOL_VERSION) + encodeString(self.ip) + self.port.to_bytes(2,"big") + encodeVarInt(STATUS_STATE)
+            writer.write(createSlpPacket(HANDSHAKE_ID,handshake) + createSlpPacket(STATUS_ID,b"")) # Both in one go
+            packetId, payload = await readSlpPacket(reader)
+            if packetId != STATUS_ID: raise PacketError(f"Unexpected packet {packetId} instead of the status")
+            status = parseStatus(payload)
+            logging.debug(f"Status of {self.ip}:{self.port}: {status}")
+
+            if self.measureLatency:
+                loop = asyncio.get_running_loop()
+                token = struct.pack(">q",int(loop.time()*1000))
+                sent = loop.time()
+                writer.write(createSlpPacket(PING_ID,token))
+                try:
+                    packetId, payload = await readSlpPacket(reader)
+                    if packetId == PING_ID and payload == token:
+                        status.latency = loop.time() - sent
+                except asyncio.IncompleteReadError: # Some servers close the connection instead of answering
+                    pass
+            return status
+        finally:
+            writer.close()
+        pass
+
+    async def status(self) -> ServerStatus:
+        """Retrieves the status of the server: MOTD, version name and protocol number, number of players online, maximum number of players, a sample of the players online, favicon and latency\n
+        This function is a coroutine
+        """
+        try:
+            with metrics.span("mcconnect_slp_seconds") if metrics.instrumentation is not None else metrics.NO_SPAN:
+                return await asyncio.wait_for(self._status(),self.timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError) as exc:
+            raise ConnectionError(f"Could not get the status of {self.ip}:{self.port}: {exc!r}") from None
+        pass
+    pass
+
+async def scan(targets : Iterable[tuple[str,int]], *, concurrency : int = 256, timeout : float = 5, retries : int = 1, measureLatency : bool = True) -> AsyncIterator[FleetResult]:
+    """Gets the status of every (ip, port) in targets with at most concurrency requests in flight.\n
+    Works like query.scan: yields a fleet.FleetResult for every target as soon as it is done.\n
+    Usage: async for result in scan(targets): ...
+    """
+    async def status(target : tuple[str,int]) -> ServerStatus:
+        return await StatusConnection(target[0],target[1],timeout,measureLatency=measureLatency).status()
+
+    async for result in runBounded(status,targets,concurrency=concurrency,retries=retries):
+        yield result
+        pass
+    pass
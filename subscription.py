@@ -0,0 +1,45 @@
+"""A bounded, drop-oldest queue for handing a stream of items (server output, monitor events, ...) to consumers that may fall behind.\n
+Publishers keep a set of their subscriptions, call Subscription._put for every item and Subscription.close when the stream ends.
+"""
+
+import asyncio
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+class Subscription(Generic[T]):
+    """A bounded queue of the items a publisher hands out.\n
+    If the consumer falls behind by more than maxsize items, the oldest items are dropped (and counted in self.dropped) instead of slowing down the publisher.\n
+    Iterate over it with async for; the iteration ends when the publisher ends its stream or the subscription is closed.\n
+    subscriptions is the set of the publisher the subscription removes itself from when it is closed.
+    """
+    def __init__(self, subscriptions : set, maxsize : int):
+        self._subscriptions = subscriptions
+        self.maxsize = maxsize
+        self.queue : asyncio.Queue = asyncio.Queue() # Bounded by _put, so the end marker always fits
+        self.dropped = 0
+        pass
+
+    def _put(self, item : T) -> None:
+        if self.queue.qsize() >= self.maxsize:
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(item)
+        pass
+
+    def close(self) -> None:
+        """Stops receiving items. Items that are already queued can still be read."""
+        self._subscriptions.discard(self)
+        self.queue.put_nowait(None)
+        pass
+
+    def __aiter__(self) -> "Subscription[T]":
+        return self
+
+    async def __anext__(self) -> T:
+        item = await self.queue.get()
+        if item is None:
+            self.queue.put_nowait(None) # Keep ending the iteration
+            raise StopAsyncIteration
+        return item
+    pass
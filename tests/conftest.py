@@ -0,0 +1,10 @@
+"""Loads the checkout as the mcconnect package, whatever its directory is called, so the tests run against this tree."""
+
+import importlib.util, pathlib, sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+spec = importlib.util.spec_from_file_location("mcconnect",ROOT / "__init__.py",submodule_search_locations=[str(ROOT)])
+package = importlib.util.module_from_spec(spec)
+sys.modules["mcconnect"] = package
+spec.loader.exec_module(package)
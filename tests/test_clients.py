@@ -0,0 +1,181 @@
+"""Drives QueryClient, Rconnection, RconPool and Monitor against the servers from fakeservers."""
+
+import asyncio
+import pytest
+from mcconnect.errors import *
+from mcconnect.fakeservers import FakeQueryServer, FakeRconServer
+from mcconnect.monitor import Monitor, EventTypes
+from mcconnect.query import QueryClient, QueryConnection, BasicStat, FullStat, createQueryPacket, CHALLENGE_REQ_TYPE, STAT_REQ_TYPE
+from mcconnect.rcon import Rconnection, RconPool, MAX_SC_LENGTH
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine,10))
+
+class _Receiver(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.answers : asyncio.Queue = asyncio.Queue()
+        pass
+
+    def datagram_received(self, data, addr):
+        self.answers.put_nowait(data)
+        pass
+    pass
+
+class _InvalidTokenServer(FakeQueryServer):
+    def _respond(self, data : bytes, addr) -> bytes:
+        answer = super()._respond(data,addr)
+        if data[2] == CHALLENGE_REQ_TYPE:
+            return answer[:5] + b"garbage\x00"
+        return answer
+    pass
+
+def testStatAnswerCarriesHandshakeSessionId():
+    async def main():
+        async with FakeQueryServer() as server:
+            transport, receiver = await asyncio.get_running_loop().create_datagram_endpoint(_Receiver,remote_addr=server.address)
+            try:
+                transport.sendto(createQueryPacket(0x01020304,CHALLENGE_REQ_TYPE,b""))
+                challenge = await receiver.answers.get()
+                token = int(challenge[5:].rstrip(b"\x00"))
+                transport.sendto(createQueryPacket(0x0A0B0C0D,STAT_REQ_TYPE,token.to_bytes(4,"big",signed=True)))
+                answer = await receiver.answers.get()
+            finally:
+                transport.close()
+            assert answer[1:5] == bytes.fromhex("01020304")
+        pass
+    run(main())
+
+def testTokenIsReused():
+    async def main():
+        async with FakeQueryServer(players=["Steve"]) as server, QueryClient() as client:
+            connection = QueryConnection(*server.address,timeout=5,client=client)
+            assert (await connection.basicStat()).numplayers == 1
+            assert (await connection.basicStat()).numplayers == 1
+            assert (await connection.fullStat()).players == ["Steve"]
+            assert server.handshakes == 1
+            assert server.stats == 3
+        pass
+    run(main())
+
+def testConcurrentStatsToOneServer():
+    async def main():
+        async with FakeQueryServer(players=["Steve","Alex"]) as server, QueryClient() as client:
+            connection = QueryConnection(*server.address,timeout=5,client=client)
+            results = await asyncio.gather(*(connection.basicStat() for _ in range(10)),*(connection.fullStat() for _ in range(10)))
+            assert all(isinstance(result,BasicStat) for result in results[:10])
+            assert all(isinstance(result,FullStat) and result.players == ["Steve","Alex"] for result in results[10:])
+            assert server.handshakes == 1
+        pass
+    run(main())
+
+def testRejectedTokenIsRenewed():
+    async def main():
+        async with FakeQueryServer() as server, QueryClient(rejectTimeout=0.2) as client:
+            connection = QueryConnection(*server.address,timeout=5,client=client)
+            await connection.basicStat()
+            server._tokens.clear() # The server forgot the token early
+            await connection.basicStat()
+            assert server.handshakes == 2
+        pass
+    run(main())
+
+def testQueryWithoutClient():
+    async def main():
+        async with FakeQueryServer(players=["Steve"]) as server:
+            assert (await QueryConnection(*server.address,timeout=5).fullStat()).players == ["Steve"]
+        pass
+    run(main())
+
+def testInvalidChallengeToken():
+    async def main():
+        async with _InvalidTokenServer() as server:
+            with pytest.raises(PacketError):
+                await QueryConnection(*server.address,timeout=5).basicStat()
+        pass
+    run(main())
+
+def testFragmentedResponses():
+    async def main():
+        async with FakeRconServer() as server:
+            rcon = Rconnection(*server.address,server.password)
+            await rcon.start()
+            try:
+                sizes = [10, MAX_SC_LENGTH - 1, MAX_SC_LENGTH, MAX_SC_LENGTH + 1, 2*MAX_SC_LENGTH, 10000]
+                responses = await asyncio.gather(*(rcon.command(f"big {size}") for size in sizes))
+                assert [len(response) for response in responses] == sizes
+            finally:
+                await rcon.close()
+        pass
+    run(main())
+
+def testSentinelEndsResponse():
+    async def main():
+        async with FakeRconServer() as server:
+            rcon = Rconnection(*server.address,server.password)
+            await rcon.start()
+            try:
+                # A response filling exactly one packet looks complete either way; only the sentinel tells it ended
+                assert len(await rcon.command(f"big {MAX_SC_LENGTH}")) == MAX_SC_LENGTH
+                assert await rcon.command("list") == "list"
+                assert await rcon.commands(["a",f"big {2*MAX_SC_LENGTH}","b"]) == ["a","x"*(2*MAX_SC_LENGTH),"b"]
+            finally:
+                await rcon.close()
+        pass
+    run(main())
+
+def testWrongPassword():
+    async def main():
+        async with FakeRconServer() as server:
+            rcon = Rconnection(*server.address,"wrong")
+            try:
+                with pytest.raises(AuthError):
+                    await rcon.start()
+            finally:
+                await rcon.close()
+        pass
+    run(main())
+
+def testPoolReconnects():
+    async def main():
+        async with FakeRconServer() as server:
+            pool = RconPool(*server.address,server.password,maxSize=1,backoff=0.01,healthInterval=0)
+            try:
+                assert await pool.command("list") == "list"
+                for writer in list(server._writers): # The server drops every connection
+                    writer.close()
+                    pass
+                await asyncio.sleep(0.1)
+                assert await pool.command("list") == "list"
+                assert server.connections == 2
+            finally:
+                await pool.close()
+        pass
+    run(main())
+
+def testPoolGivesUp():
+    async def main():
+        async with FakeRconServer() as server:
+            address = server.address
+        pool = RconPool(*address,"test",retries=2,backoff=0.01,healthInterval=0)
+        try:
+            with pytest.raises(ConnectionError):
+                await pool.command("list")
+        finally:
+            await pool.close()
+        pass
+    run(main())
+
+def testMonitorSurvivesUnexpectedErrors():
+    async def main():
+        async with FakeQueryServer() as server:
+            async with Monitor([server.address],interval=0.05,maxInterval=0.05,timeout=1,offlineAfter=2) as monitor:
+                subscription = monitor.subscribe()
+                assert (await subscription.__anext__()).type == EventTypes.ONLINE
+                connection = monitor._servers[tuple(server.address)].connection
+                async def broken():
+                    raise ValueError("broken")
+                connection.fullStat = broken
+                assert (await subscription.__anext__()).type == EventTypes.OFFLINE
+                assert not monitor._servers[tuple(server.address)].task.done()
+        pass
+    run(main())